@@ -22,6 +22,7 @@ import gtk
 import os
 import paths
 import utils
+import numpy as np
 import events as evt
 import matplotlib.cm as cm
 from matplotlib.axes        import Axes as mpl_Axes
@@ -75,8 +76,9 @@ class LineConfig:
 
     def copy_mpl_line1(self):
         # TODO: make more general. Not allways is first line of this type!
+        x_values, y_values = self.mpl_line1.get_data()
         l = mpl_Line(
-            self.x_values, self.y_values, marker='o',
+            x_values, y_values, marker='o',
             drawstyle='steps-post', color=self.color)
         return l
 
@@ -170,6 +172,100 @@ class DrawLinesConfig:
             else:
                 change.set_mpl_line2('create_new')
 
+class IntervalRows:
+
+    """ Rows of intervals (e.g. executions of transitions) drawn by the level
+    of detail of the current view. Intervals closer than one pixel are merged
+    into one span and the number of spans in a row is limited; spans are
+    computed again when the view of the chart is changed.
+
+    Arguments:
+    ax -- an instance of BasicChart
+    values -- a list of masked arrays with columns 'Time' and 'Duration',
+              one for each row
+    ys -- y coordinates of rows
+    height -- a height of rows
+    style -- properties of collections of bars
+    """
+
+    # the maximal number of spans drawn in a row
+    max_spans = 2000
+
+    def __init__(self, ax, values, ys, height, **style):
+        self.ax = ax
+        self.rows = []
+        self.collections = []
+        for data, y in zip(values, ys):
+            valid = ~np.ma.getmaskarray(data["Time"])
+            starts = np.ma.getdata(data["Time"])[valid].astype(float)
+            ends = starts + np.ma.filled(data["Duration"], 0)[valid]
+            if np.any(starts[1:] < starts[:-1]):
+                order = np.argsort(starts, kind="mergesort")
+                starts, ends = starts[order], ends[order]
+            longest = (ends - starts).max() if len(starts) else 0
+            self.rows.append((starts, ends, longest, y, height))
+            self.collections.append(ax.broken_barh([], (y, height), **style))
+        ax.set_callback("view_changed", self.update)
+
+    def get_end(self):
+        return max([row[1].max() for row in self.rows if len(row[1])] + [0])
+
+    def update(self, xmin, xmax):
+        resolution = (xmax - xmin) / max(self.ax.bbox.width, 1)
+        for row, collection in zip(self.rows, self.collections):
+            starts, ends, longest, y, height = row
+            span_starts, span_ends = coverage_spans(
+                starts, ends, longest, xmin, xmax, resolution, self.max_spans)
+            collection.set_verts(
+                [((s, y), (s, y + height), (e, y + height), (e, y))
+                 for s, e in zip(span_starts.tolist(), span_ends.tolist())])
+
+class EnvelopeLines:
+
+    """ Step lines decimated by the level of detail of the current view.
+    Points of a line which fall into the same pixel are replaced by the
+    first point, the minimum, the maximum and the last point, so peaks stay
+    visible. Lines are decimated again when the view of the chart is changed.
+
+    Arguments:
+    ax -- an instance of BasicChart
+    lines_config -- a list of LineConfig objects with sorted x-values
+    """
+
+    # lines with less visible points are drawn without decimation
+    max_points = 4000
+
+    def __init__(self, ax, lines_config):
+        self.ax = ax
+        self.lines = []
+        for line_config in lines_config:
+            xs = np.ma.asarray(line_config.get_x_values())
+            ys = np.ma.asarray(line_config.get_y_values())
+            valid = ~(np.ma.getmaskarray(xs) | np.ma.getmaskarray(ys))
+            self.lines.append((line_config,
+                               np.ma.getdata(xs)[valid],
+                               np.ma.getdata(ys)[valid]))
+        ax.set_callback("view_changed", self.update)
+
+    def get_limits(self):
+        """ Return limits of data as ((xmin, ymin), (xmax, ymax)). """
+        points = [(xs[[0, -1]], ys[[ys.argmin(), ys.argmax()]])
+                  for line_config, xs, ys in self.lines if len(xs)]
+        if not points:
+            return (0, 0), (0, 0)
+        xs = np.concatenate([p[0] for p in points])
+        ys = np.concatenate([p[1] for p in points])
+        return (xs.min(), ys.min()), (xs.max(), ys.max())
+
+    def update(self, xmin, xmax):
+        resolution = (xmax - xmin) / max(self.ax.bbox.width, 1)
+        for line_config, xs, ys in self.lines:
+            data = envelope(xs, ys, xmin, xmax, resolution, self.max_points)
+            line_config.get_mpl_line1().set_data(*data)
+            line2 = line_config.get_mpl_line2()
+            if isinstance(line2, mpl_Line):
+                line2.set_data(*data)
+
 class BasicChart(mpl_Axes, evt.EventSource):
 
     name = 'basic_chart'
@@ -236,6 +332,8 @@ class BasicChart(mpl_Axes, evt.EventSource):
         fig.canvas.mpl_connect("key_release_event", self._switch_ylock_action)
         # register event which stop is drawing cross if it's cursorn over legend
         fig.canvas.mpl_connect("motion_notify_event", self._mouse_over_legend)
+        # a resolution of the view depends on the size of the canvas
+        fig.canvas.mpl_connect("resize_event", lambda e: self.view_changed())
 
     def __convert_axes_to_data(self, x, y):
         xdisplay, ydisplay = self.transAxes.transform((x,y))
@@ -400,6 +498,7 @@ class BasicChart(mpl_Axes, evt.EventSource):
             self.cross_bg = None
             self.rect_bg = None
 
+            self.view_changed()
             self.figure.canvas.draw_idle()
 
     def _zoom_out(self, event):
@@ -418,6 +517,7 @@ class BasicChart(mpl_Axes, evt.EventSource):
                     ymin is not None and ymax is not None:
                 self.set_xlim(xmin, xmax)
                 self.set_ylim(ymin, ymax)
+                self.view_changed()
                 self.figure.canvas.draw_idle()
 
     def _move_start(self, event):
@@ -453,6 +553,7 @@ class BasicChart(mpl_Axes, evt.EventSource):
             self.set_ylim(data_ymin, data_ymax)
             # shift for next step
             self.xypress = (x, y)
+            self.view_changed()
             self.figure.canvas.draw_idle()
 
     def _switch_xlock_action(self, event):
@@ -490,6 +591,12 @@ class BasicChart(mpl_Axes, evt.EventSource):
             else:
                 self.mouse_on_legend = False
 
+    def view_changed(self):
+        ''' Announce that the visible range of data was changed; listeners of
+        'view_changed' get limits of the x axis. '''
+        xmin, xmax = self.get_xlim()
+        self.emit_event("view_changed", xmin, xmax)
+
     def set_xlock(self, lock):
         self.xlock = lock
         self.emit_event("xlock_changed", lock)
@@ -718,6 +825,7 @@ class ChartWidget(gtk.VBox):
             ax.zoom_stack = []
             ax.set_xlim(xmin, xmax)
             ax.set_ylim(ymin, ymax)
+            ax.view_changed()
             ax.figure.canvas.draw_idle()
 
     def _btn_save_action(self, widget):
@@ -753,6 +861,75 @@ class ChartWidget(gtk.VBox):
 #*******************************************************************************
 # Defined method for "standard" graphs:
 
+def coverage_spans(starts, ends, longest, xmin, xmax, resolution, limit):
+    """ Merge intervals visible in the range <xmin, xmax> into spans; gaps
+    which are not wider than the resolution are covered by a span. The
+    resolution is coarsened until there are less than limit spans.
+
+    Arguments:
+    starts -- sorted starts of intervals
+    ends -- ends of intervals
+    longest -- the maximal length of an interval
+    xmin, xmax -- the visible range
+    resolution -- the width of one pixel in data coordinates
+    limit -- the maximal number of spans
+    """
+
+    i = np.searchsorted(starts, xmin - longest, side="left")
+    j = np.searchsorted(starts, xmax, side="right")
+    starts, ends = starts[i:j], ends[i:j]
+    visible = ends >= xmin
+    starts, ends = starts[visible], ends[visible]
+    if len(starts) == 0:
+        return starts, ends
+
+    # the furthest point covered by intervals before each interval
+    reach = np.maximum.accumulate(ends)[:-1]
+    gaps = starts[1:] - reach
+    resolution = max(resolution, 0)
+    while True:
+        breaks = np.flatnonzero(gaps > resolution) + 1
+        if len(breaks) < limit:
+            break
+        resolution = resolution * 2 if resolution > 0 else gaps.max() / limit
+
+    firsts = np.concatenate(([0], breaks))
+    span_starts = np.maximum(starts[firsts], xmin)
+    span_ends = np.minimum(np.maximum.reduceat(ends, firsts), xmax)
+    return span_starts, span_ends
+
+def envelope(xs, ys, xmin, xmax, resolution, limit):
+    """ Decimate a step line in the range <xmin, xmax>. Points in the same
+    bucket of the width of the resolution are replaced by four points: the
+    first point, the minimum, the maximum and the last point of the bucket.
+
+    Arguments:
+    xs -- sorted x-values of the line
+    ys -- y-values of the line
+    xmin, xmax -- the visible range
+    resolution -- the width of one pixel in data coordinates
+    limit -- lines with less visible points are not decimated
+    """
+
+    # the point before xmin determines the value at xmin
+    i = max(np.searchsorted(xs, xmin, side="right") - 1, 0)
+    j = np.searchsorted(xs, xmax, side="right") + 1
+    xs, ys = xs[i:j], ys[i:j]
+    if len(xs) < limit or resolution <= 0:
+        return xs, ys
+
+    buckets = np.floor((xs - xs[0]) / resolution)
+    firsts = np.concatenate(([0], np.flatnonzero(np.diff(buckets)) + 1))
+    lasts = np.append(firsts[1:], len(xs)) - 1
+
+    x_values = np.repeat(xs[firsts], 4)
+    x_values[3::4] = xs[lasts]
+    y_values = np.column_stack((ys[firsts],
+                                np.minimum.reduceat(ys, firsts),
+                                np.maximum.reduceat(ys, firsts),
+                                ys[lasts])).ravel()
+    return x_values, y_values
+
 def _empty_chart(title="", xlabel="", ylabel=""):
     figure = mpl_Figure()
     canvas = mpl_FigureCanvas(figure)
@@ -804,7 +981,10 @@ def _register_histogram_pick_legend(ax, legend, lines_config):
 
     ax.figure.canvas.mpl_connect('pick_event', on_pick)
 
-def histogram(names, values, title="", xlabel="", ylabel=""):
+def histogram(names, values, title="", xlabel="", ylabel="", edges=None):
+    """ Draw histograms of values; if edges of bins are given, values are
+    already counts of values in the bins (see `Table.histogram`).
+    """
 
     if not names or not values:
         return _empty_chart(title, xlabel, ylabel)
@@ -816,8 +996,14 @@ def histogram(names, values, title="", xlabel="", ylabel=""):
     ax = figure.add_subplot(111, projection=BasicChart.name)
 
     colors = [cm.hsv(float(i)/len(values)) for i in xrange(len(values))]
-    n, bins, patches = ax.hist(
-        values, 10, normed=0, histtype="bar", label=names, color=colors)
+    if edges is None:
+        n, bins, patches = ax.hist(
+            values, 10, normed=0, histtype="bar", label=names, color=colors)
+    else:
+        # each count is a weight of the left edge of its bin
+        n, bins, patches = ax.hist(
+            [edges[:-1]] * len(values), edges, weights=values, normed=0,
+            histtype="bar", label=names, color=colors)
 
     for label in ax.xaxis.get_ticklabels():
         label.set_rotation(-35)
@@ -852,21 +1038,16 @@ def utilization_chart(names,
     ax = figure.add_subplot(111, projection=BasicChart.name)
 
     ywidth = 2
-    yticks = []
 
+    # intervals are drawn by the level of detail of the current view
+    ys = [(ywidth+1) * (i+ 1) for i in xrange(len(values))]
+    rows = []
     if idles is not None:
-        for i, lidle in enumerate(idles):
-            y = ((i+1) * ywidth) + (i+1)
-            ax.broken_barh(
-                lidle, (y, ywidth),
-                edgecolor='face', facecolor='#EAA769')
-
-    for i, ldata in enumerate(values):
-        y = (ywidth+1) * (i+ 1)
-        yticks.append(y + ywidth/2)
-        ax.broken_barh(
-            ldata, (y, ywidth),
-            edgecolor='face', facecolor='green')
+        rows.append(IntervalRows(ax, idles, ys, ywidth,
+                                 edgecolor='face', facecolor='#EAA769'))
+    rows.append(IntervalRows(ax, values, ys, ywidth,
+                             edgecolor='face', facecolor='green'))
+    yticks = [y + ywidth/2 for y in ys]
 
     ax.set_yticks(yticks)
     ax.set_yticklabels(names)
@@ -892,7 +1073,8 @@ def utilization_chart(names,
     ax.xaxis.grid(True, linestyle="-", which='major', color='black', alpha=0.7)
     ax.xaxis.set_major_formatter(mpl_FuncFormatter(
         lambda time, pos: utils.time_to_string(time)[:-7]))
-    ax.set_xlim(xmin=0)
+    ax.set_xlim(0, max([r.get_end() for r in rows] + [1]))
+    ax.set_ylim(0, ys[-1] + ywidth + 1)
     ax.get_figure().tight_layout()
 
     ax.set_title(title)
@@ -902,6 +1084,7 @@ def utilization_chart(names,
     # resize figure
     w, h = figure.get_size_inches()
     figure.set_size_inches(w, len(values) * 0.4)
+    ax.view_changed()
     return ChartWidget(figure, ylock=True)
 
 def place_chart(names, values, title="", xlabel="", ylabel=""):
@@ -915,13 +1098,16 @@ def place_chart(names, values, title="", xlabel="", ylabel=""):
 
     ax = figure.add_subplot(111, projection=BasicChart.name)
 
-    # fill data
+    # fill data; lines are decimated by the level of detail of the view
     lines_config = []
     for i, (xvalues, yvalues) in enumerate(values):
         line, = ax.plot(
-            xvalues, yvalues, 'o-', drawstyle="steps-post", label=names[i])
+            [], [], 'o-', drawstyle="steps-post", label=names[i])
         lines_config.append(
             LineConfig(line, xvalues, yvalues, line.get_color()))
+    lines = EnvelopeLines(ax, lines_config)
+    ax.update_datalim(lines.get_limits())
+    ax.autoscale_view()
 
     for label in ax.xaxis.get_ticklabels():
         label.set_rotation(-35)
@@ -940,6 +1126,7 @@ def place_chart(names, values, title="", xlabel="", ylabel=""):
     ax.set_xlabel(xlabel)
     ax.set_ylabel(ylabel)
 
+    ax.view_changed()
     return ChartWidget(figure)
 
 def _register_new_types_charts():
@@ -36,6 +36,10 @@ import paths
 sys.path.append(paths.PTP_DIR)
 import loader
 import os
+import re
+import types
+import traceback
+import multiprocessing
 import tracelog
 
 
@@ -56,9 +60,113 @@ def export(filename, directory, trace, lib):
         build_config.directory = os.path.dirname(filename)
     p.export(build_config)
 
-def check_tracelog(filename):
-    t = tracelog.TraceLog(filename)
+def check_tracelog(filename, time_range=None, follow=False, data=False):
+    t = tracelog.TraceLog(filename, data, time_range=time_range, follow=follow)
+    if follow:
+        while t.update():
+            pass
+        t.stop_following()
     print t.get_runinstances_count()
+    if data:
+        print len(t.data)
+
+def import_charts():
+    """ Import charts of a tracelog view which render by Agg instead of the
+    GTK canvas; created charts are figures instead of widgets.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    backend = types.ModuleType("matplotlib.backends.backend_gtkagg")
+    backend.FigureCanvasGTKAgg = FigureCanvasAgg
+    sys.modules["matplotlib.backends.backend_gtkagg"] = backend
+    sys.modules["gobject"] = Empty()
+    sys.modules["pango"] = Empty()
+    import charts
+    import runview
+    charts.ChartWidget = lambda figure, **kw: figure
+    return runview
+
+def report_prefixes(filenames, directory):
+    """ Return prefixes of names of files with charts for tracelogs. If a
+    name of a tracelog is not unique in the directory, the name of its parent
+    directory is added. None is returned when prefixes are still not unique.
+
+    Arguments:
+    filenames -- names of tracelogs
+    directory -- the output directory; if it is None, files are written
+    next to each tracelog
+    """
+    filenames = map(os.path.abspath, filenames)
+    directories = [ directory or os.path.dirname(filename)
+                    for filename in filenames ]
+    prefixes = [ os.path.join(d, os.path.splitext(os.path.basename(f))[0])
+                 for d, f in zip(directories, filenames) ]
+    names = list(prefixes)
+    for i, filename in enumerate(filenames):
+        if names.count(names[i]) > 1:
+            parent = os.path.basename(os.path.dirname(filename))
+            prefixes[i] = os.path.join(directories[i], "{0}-{1}".format(
+                parent, os.path.basename(names[i])))
+    if len(set(prefixes)) != len(prefixes):
+        return None
+    return prefixes
+
+def render_charts(filename, prefix, formats):
+    """ Render charts of a tracelog into files with the prefix; return
+    a list of names of created files.
+    """
+    runview = import_charts()
+    t = tracelog.TraceLog(filename, True)
+    filenames = []
+    for name, prepare in runview.chart_preparations(t):
+        create_chart = prepare()
+        if create_chart is None:
+            continue
+        figure = create_chart()
+        slug = re.sub("[^a-z0-9]+", "-", name.lower()).strip("-")
+        for format in formats:
+            output = "{0}-{1}.{2}".format(prefix, slug, format)
+            figure.savefig(output, format=format)
+            filenames.append(output)
+    return filenames
+
+def _render_charts(args):
+    try:
+        return (args[0], render_charts(*args), None)
+    except Exception:
+        return (args[0], [], traceback.format_exc())
+
+def render_reports(filenames, directory, formats, workers):
+    """ Render charts of tracelogs in a pool of processes; each tracelog
+    is loaded and rendered by one process. Return True if all tracelogs
+    were rendered.
+    """
+    prefixes = report_prefixes(filenames, directory)
+    if prefixes is None:
+        print >> sys.stderr, "Charts of tracelogs would be written " \
+                             "into the same files."
+        return False
+    tasks = [ (os.path.abspath(filename), prefix, formats)
+              for filename, prefix in zip(filenames, prefixes) ]
+    if workers > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(workers, len(tasks)))
+        try:
+            results = pool.map(_render_charts, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = map(_render_charts, tasks)
+
+    success = True
+    for filename, outputs, error in results:
+        if error is not None:
+            success = False
+            print >> sys.stderr, "{0}: rendering failed\n{1}".format(filename, error)
+        for output in outputs:
+            print output
+    return success
 
 def main():
     parser = argparse.ArgumentParser(description='Kaira gui command line controller')
@@ -67,12 +175,26 @@ def main():
     parser.add_argument("--trace", action='store_true')
     parser.add_argument('--tracelog', metavar='filename', type=str)
     parser.add_argument("--lib", action='store_true')
+    parser.add_argument('--window', metavar=('start', 'end'), type=int, nargs=2)
+    parser.add_argument("--follow", action='store_true')
+    parser.add_argument("--data", action='store_true')
+    parser.add_argument('--report', metavar='filename', type=str, nargs='+')
+    parser.add_argument('--format', type=str, action='append',
+                        choices=["png", "svg", "pdf"])
+    parser.add_argument('--workers', metavar='number', type=int,
+                        default=multiprocessing.cpu_count())
     args = parser.parse_args()
+    if args.window and args.window[0] > args.window[1]:
+        parser.error("the start of the window is behind its end")
     if args.export:
         export(os.path.abspath(args.export), args.output, args.trace, args.lib)
         return
     if args.tracelog:
-        check_tracelog(args.tracelog)
+        check_tracelog(args.tracelog, args.window, args.follow, args.data)
+    if args.report:
+        if not render_reports(args.report, args.output,
+                              args.format or ["png"], args.workers):
+            sys.exit(1)
 
 if __name__ == "__main__":
     main()
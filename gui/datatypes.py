@@ -18,7 +18,7 @@
 #    along with Kaira.  If not, see <http://www.gnu.org/licenses/>.
 #
 
-import csv
+import multiprocessing
 
 import gtk
 import gtkutils
@@ -27,6 +27,7 @@ import runview
 import numpy as np
 from tracelog import TraceLog
 from table import Table
+from tablefile import read_csv, write_csv, read_npz, write_npz
 
 """Supported types for extensions."""
 
@@ -154,7 +155,7 @@ def get_save_file_filter(type):
 t_tracelog = Type("Kaira tracelog", "Tracelog")
 def load_kth(filename, app, settings=None):
     def load_tracelog():
-        tracelog = TraceLog(filename, True)
+        tracelog = TraceLog(filename, True, multiprocessing.cpu_count())
         if tracelog.missed_receives > 0:
             app.console_write(
                 "{1} mismatched receives were found in tracelog {0}.\n" \
@@ -223,39 +224,12 @@ def load_csv(filename, app, settings):
     if settings is None:
         return (None, None) # settings was canceled
 
-    delimiter, quotechar, has_header, has_types = settings
-    with open(filename, "rb") as csvfile:
-        csvreader = csv.reader(
-            csvfile, delimiter=delimiter, quotechar=quotechar)
-
-        try:
-            types = None
-            if has_types:
-                types = csvreader.next()
-
-            header = None
-            if has_header:
-                header = csvreader.next()
-
-            row = csvreader.next()  # first row with data
-        except StopIteration:
-            table = Table([("V0", "object")], 0)
-            return (table, None);
-
-        if types is None:
-            types = ["object"] * len(row)
-        if header is None:
-            header = ["V {0}".format(i + 1) for i in range(len(row))]
-        cols_description = zip(header, types)
-
-        table = Table(cols_description, 100)
-        row = [None if value == '' else value for value in row]
-        table.add_row(row) # add the first loaded row with data
-        for row in csvreader:
-            row = [None if value == '' else value for value in row]
-            table.add_row(row);
-        table.trim()
-        return (table, settings)
+    progress = console_progress(lambda line: app.console_write(line, "info"),
+                                "Loading '{0}'".format(filename))
+    table = read_csv(filename, *settings, progress=progress)
+    if not len(table):
+        return (table, None)
+    return (table, settings)
 
 t_table.register_load_function("csv", load_csv)
 
@@ -265,20 +239,61 @@ def store_csv(table, filename, app, settings):
     if settings is None:
         return (False, None)
 
-    delimiter, quotechar, has_header, has_types = settings
-    with open(filename, "w") as csvfile:
-        csvwriter = csv.writer(
-            csvfile, delimiter=delimiter, quotechar=quotechar)
-        if has_types:
-            csvwriter.writerow(table.types)
-        if has_header:
-            csvwriter.writerow(table.header)
-        for row in table:
-            csvwriter.writerow(row)
+    progress = console_progress(lambda line: app.console_write(line, "info"),
+                                "Saving '{0}'".format(filename))
+    write_csv(table, filename, *settings, progress=progress)
     return (True, settings)
 
 t_table.register_store_function("csv", store_csv)
 
+def show_npz_settings_dialog(parent_window):
+    sw = settingswindow.SettingWidget()
+    sw.add_radiobuttons("compress",
+                        "Compression",
+                        [("None (fast loading)", False), ("Zip", True)],
+                        default=0,
+                        ncols=2)
+
+    dialog = settingswindow.BasicSettingDialog(sw, "Setting", parent_window)
+    dialog.set_size_request(400, 120)
+    dialog.add_button(gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL)
+    dialog.add_button(gtk.STOCK_OK, gtk.RESPONSE_OK, True)
+
+    response = dialog.run()
+    dialog.destroy()
+    if response == gtk.RESPONSE_OK:
+        return dialog.get_setting("compress")
+    return None
+
+def load_npz(filename, app, settings):
+    return (app._catch_io_error(lambda: read_npz(filename)), settings)
+
+t_table.register_load_function("npz", load_npz)
+
+def store_npz(table, filename, app, settings):
+    if settings is None:
+        settings = show_npz_settings_dialog(app.window)
+    if settings is None:
+        return (False, None)
+
+    write_npz(table, filename, settings)
+    return (True, settings)
+
+t_table.register_store_function("npz", store_npz)
+
+def console_progress(callback, text):
+    """ Return a function reporting a progress of a long operation by steps
+    of ten percents; the callback gets lines of the report (e.g. it writes
+    them into the console).
+    """
+    state = [0]
+    def progress(part):
+        percents = int(part * 10) * 10
+        if percents > state[0]:
+            state[0] = percents
+            callback("{0}: {1}%\n".format(text, percents))
+    return progress
+
 def csv_view(table, app):
     colnames = [(title, str) for title in table.header]
 
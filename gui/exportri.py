@@ -18,16 +18,22 @@
 #    along with Kaira.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
 import settingswindow
+import numpy as np
 from runinstance import RunInstance
-from table import  Table
+from table import  Table, to_column
 from gtk import RESPONSE_APPLY
 
 class ExportRunInstance(RunInstance):
 
     basic_header = ["Event", "Time", "Duration", "Process", "ID"]
 
-    def __init__(self, tracelog, transitions, place_functions, columns):
+    # Rows are collected in a list and moved into columns in batches
+    batch_size = 4096
+
+    def __init__(self, tracelog, transitions, place_functions, columns,
+                 directory=None):
         RunInstance.__init__(self,
                              tracelog.project,
                              tracelog.process_count)
@@ -51,13 +57,30 @@ class ExportRunInstance(RunInstance):
         self.column_value = bool(place_functions)
         self.column_tokens = bool(self.traced_places)
 
-        self.table = self._create_table()
+        self.columns = self._create_columns()
+        self.table = Table(self.columns, self.batch_size, directory=directory)
+        if self.column_time:
+            self.table.create_index("Time")
+        self.rows = []
 
         self.idles = [None] * self.process_count
         self.tokens_counters = [[0] * len(self.traced_places)
                                 for p in range(tracelog.process_count)]
 
-    def _create_table(self):
+    def set_state(self, runinstance):
+        RunInstance.set_state(self, runinstance)
+        # Counters of tokens are set from the marking
+        for process_id, counters in enumerate(self.tokens_counters):
+            instance = self.net_instances.get(process_id)
+            if instance is None:
+                continue
+            for index, (place_id, place) in \
+                    enumerate(self.traced_places.items()):
+                counters[index] = \
+                    len(instance.tokens.get(place_id) or ()) + \
+                    len(instance.new_tokens.get(place_id) or ())
+
+    def _create_columns(self):
         header = []
         types = [];
         if self.column_event:
@@ -93,35 +116,79 @@ class ExportRunInstance(RunInstance):
                 header.append(col_name)
                 types.append('<i4')
 
-        return Table(zip(header, types), 100)
+        return zip(header, types)
 
     def add_row(self, event, time, duration, process, id, (col_name, value)):
-        row = []
+        if self.column_tokens and event == 'C':
+            couter_index = self.tokens_indexes[col_name]
+            self.tokens_counters[process][couter_index] += value
+
+        if event == 'A' and self.column_value:
+            value_index = self.values_indexes[col_name]
+        else:
+            value_index = -1
+        if self.column_tokens:
+            counters = tuple(self.tokens_counters[process])
+        else:
+            counters = ()
+        self.rows.append((event, time, duration, process, id,
+                          value_index, value, counters))
+        if len(self.rows) >= self.batch_size:
+            self._flush_rows()
+
+    def _flush_rows(self):
+        """ Convert collected rows into columns and append them into
+        the table.
+        """
+        if not self.rows:
+            return
+        events, times, durations, processes, ids, \
+            value_indexes, values, counters = zip(*self.rows)
+        self.rows = []
+
+        columns = []
         if self.column_event:
-            row.append(event)
+            columns.append(to_column(events, "|S1"))
         if self.column_time:
-            row.append(time)
+            columns.append(to_column(times, "<u8"))
         if self.column_duration:
-            row.append(duration)
+            columns.append(to_column(durations, "<u8"))
         if self.column_process:
-            row.append(process)
+            columns.append(to_column(processes, "<i4"))
         if self.column_id:
-            row.append(id)
+            columns.append(to_column(ids, "<i4"))
         if self.column_value:
-            values = [None] * len(self.place_functions)
-            if event == 'A':
-                values[self.values_indexes[col_name]] = value
-            row += values
+            value_indexes = np.array(value_indexes)
+            first = len(columns)
+            for index in xrange(len(self.place_functions)):
+                name, dtype = self.columns[first + index]
+                valid = value_indexes == index
+                data = np.zeros(len(valid), dtype=dtype)
+                data[valid] = [ values[i] for i in np.flatnonzero(valid) ]
+                columns.append((data, valid))
         if self.column_tokens:
-            if event == 'C':
-                couter_index = self.tokens_indexes[col_name]
-                self.tokens_counters[process][couter_index] += value
-            row += self.tokens_counters[process]
-
-        self.table.add_row(row)
+            counters = np.array(counters, dtype="<i4")
+            for index in xrange(counters.shape[1]):
+                columns.append((counters[:, index], None))
+        if columns:
+            data, valid = zip(*columns)
+            self.table.extend(data, valid)
+
+    def get_decode_profile(self):
+        """ Return which payloads of events have to be decoded to fill
+        the exported columns (see Trace.process_event).
+        """
+        if self.column_value:
+            return "full"
+        if self.column_tokens:
+            return "counters"
+        return "timing"
 
     def get_table(self):
-        self.table.trim()
+        """ Return a table with rows collected so far; rows may be still
+        added into the run instance.
+        """
+        self._flush_rows()
         return self.table
 
     # Collected events
@@ -228,6 +295,12 @@ def run_assistant(app, tracelog):
 
         data += counters
         w.add_checkbuttons("columns", "Columns", data)
+        w.add_separator()
+        def validator(directory):
+            if directory and not os.path.isdir(directory):
+                return "'{0}' is not a directory.".format(directory)
+        w.add_entry("directory", "Store in directory\n(empty = in memory)",
+                    "", validator)
         return w
 
     assistant.append_setting_widget("Events", page_1)
@@ -238,4 +311,5 @@ def run_assistant(app, tracelog):
 
     return (assistant.get_setting("transitions"),
             assistant.get_setting("place_functions"),
-            assistant.get_setting("columns"))
+            assistant.get_setting("columns"),
+            assistant.get_setting("directory") or None)
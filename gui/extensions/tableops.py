@@ -19,11 +19,13 @@
 
 import settingswindow
 import utils
+import operator
 from functools import partial
 from extensions import Parameter, Source, Operation, add_operation
 from datatypes import t_table
 from table import Table
-from gtk import RESPONSE_APPLY
+from tablefilter import RowFilter, FilterException
+from gtk import RESPONSE_APPLY, MESSAGE_WARNING
 
 class Filter(Operation):
 
@@ -37,6 +39,13 @@ class Filter(Operation):
                                                          app.window)
         assistant.set_size_request(600, 400)
 
+        def validate_expression(text):
+            if text.strip():
+                try:
+                    RowFilter(text, table.header)
+                except FilterException as e:
+                    return str(e)
+
         def create_page_1(setting):
             items = [(label, idx, False)
                      for idx, label in enumerate(table.header)]
@@ -51,6 +60,11 @@ class Filter(Operation):
             s_widget = settingswindow.SettingWidget()
             s_widget.add_checkbuttons_list(
                 "filter_by", "Filter by columns", items, ["Column", "Select?"])
+            s_widget.add_separator()
+            s_widget.add_entry("expression",
+                               "Expression",
+                               "",
+                               validator=validate_expression)
             return s_widget
 
         def create_page_3(setting):
@@ -75,10 +89,10 @@ class Filter(Operation):
                                                      table.types[col_idx]))
                 s_widget.add_radiobuttons("cmp_fn{0}".format(col_idx),
                                           "Compare",
-                                          [("Equal", lambda x, y: x == y),
-                                           ("Not equal", lambda x, y: x != y),
-                                           ("Less than", lambda x, y: x < y),
-                                           ("Greater than", lambda x, y: x > y)],
+                                          [("Equal", operator.eq),
+                                           ("Not equal", operator.ne),
+                                           ("Less than", operator.lt),
+                                           ("Greater than", operator.gt)],
                                           ncols=2)
             return s_widget
 
@@ -92,15 +106,82 @@ class Filter(Operation):
         selected_columns = assistant.get_setting("selected_cols")
         filter_by_columns = assistant.get_setting("filter_by")
 
-        filters = []
+        query = table.query().select(selected_columns)
         for col_idx in filter_by_columns:
             cmp_function = assistant.get_setting("cmp_fn{0}".format(col_idx))
             value = assistant.get_setting("filter_value{0}".format(col_idx))
             value = utils.convert_to_type(table.types[col_idx], value)
-            filters.append((table.header[col_idx], cmp_function, value))
+            query = query.where(col_idx, cmp_function, value)
+        expression = assistant.get_setting("expression")
+        if expression.strip():
+            query = query.matching(RowFilter(expression))
 
-        filtered = table.select(selected_columns, filters)
-        t = Table.create_from_data(filtered)
+        t = Table.create_from_data(query.execute())
         return Source("Filtered table", t_table, t)
 
 add_operation(Filter)
+
+class Join(Operation):
+
+    name = "Table join"
+    description = "Join rows of two tables with equal values in key columns"
+    parameters = [Parameter("First table", t_table),
+                  Parameter("Second table", t_table)]
+
+    def run(self, app, table1, table2):
+        assistant = settingswindow.BasicSettingAssistant(2,
+                                                         "Join setting",
+                                                         app.window)
+        assistant.set_size_request(600, 400)
+
+        def create_page_1(setting):
+            items = [(label, idx, False)
+                     for idx, label in enumerate(table1.header)]
+            s_widget = settingswindow.SettingWidget()
+            s_widget.add_checkbuttons_list(
+                "keys1", "Keys of the\nfirst table", items, ["Column", "Key?"])
+            return s_widget
+
+        def create_page_2(setting):
+            # each key of the first table is paired with a column of the
+            # second table, a column with the same name is preselected
+            items = [(label, idx) for idx, label in enumerate(table2.header)]
+            s_widget = settingswindow.SettingWidget()
+            for i, key in enumerate(setting.get_value("keys1")):
+                name = table1.header[key]
+                default = table2.header.index(name) \
+                          if name in table2.header else 0
+                s_widget.add_combobox("key2_{0}".format(i),
+                                      "Key for '{0}'".format(name),
+                                      items,
+                                      default)
+            s_widget.add_separator()
+            s_widget.add_radiobuttons("outer",
+                                      "Rows",
+                                      [("Only joined rows", False),
+                                       ("All rows of the first table", True)],
+                                      ncols=2)
+            return s_widget
+
+        assistant.append_setting_widget("First table", create_page_1)
+        assistant.append_setting_widget("Second table", create_page_2)
+
+        if assistant.run() != RESPONSE_APPLY:
+            return
+
+        keys1 = assistant.get_setting("keys1")
+        keys2 = [ assistant.get_setting("key2_{0}".format(i))
+                  for i in xrange(len(keys1)) ]
+        if not keys1:
+            app.show_message_dialog("No key was selected.", MESSAGE_WARNING)
+            return
+        if len(set(keys2)) != len(keys2):
+            app.show_message_dialog(
+                "A column of the second table is paired with more keys.",
+                MESSAGE_WARNING)
+            return
+
+        t = table1.join(table2, keys1, keys2, assistant.get_setting("outer"))
+        return Source("Joined table", t_table, t)
+
+add_operation(Join)
@@ -39,7 +39,12 @@ class TracelogExport(extensions.Operation):
             return
 
         ri = ExportRunInstance(tracelog, *settings)
-        tracelog.execute_all_events(ri)
+        try:
+            tracelog.execute_all_events(ri, profile=ri.get_decode_profile())
+        except:
+            # files of an unfinished table are removed
+            ri.get_table().close()
+            raise
         return extensions.Source("Tracelog Table",
                                  datatypes.t_table,
                                  ri.get_table())
@@ -162,6 +162,58 @@ class RunInstance:
         runinstance.activites = self.activites[:]
         return runinstance
 
+    def snapshot(self):
+        """ Return a complete and independent copy of the run instance.
+        Unlike 'copy', the snapshot keeps packets, receives on debt and
+        information about the last event, hence replaying of events may
+        continue from the snapshot.
+        """
+        runinstance = RunInstance(self.project,
+                                  self.process_count)
+        runinstance.net = self.net
+        instances = {}
+        for i in self.net_instances:
+            n = self.net_instances[i].snapshot()
+            runinstance.net_instances[i] = n
+            instances[id(self.net_instances[i])] = n
+
+        # Activities are mutable (quit and blocked flags)
+        activities = {}
+        def copy_activity(activity):
+            if activity is None:
+                return None
+            if id(activity) not in activities:
+                activities[id(activity)] = copy(activity)
+            return activities[id(activity)]
+
+        runinstance.activites = map(copy_activity, self.activites)
+        runinstance.last_event = self.last_event
+        runinstance.last_event_activity = \
+            copy_activity(self.last_event_activity)
+        if self.last_event_instance is not None:
+            runinstance.last_event_instance = \
+                instances[id(self.last_event_instance)]
+        runinstance.last_event_time = self.last_event_time
+        if hasattr(self, "last_event_process"):
+            runinstance.last_event_process = self.last_event_process
+        runinstance.packets = [ packets[:] for packets in self.packets ]
+        runinstance.debt_receives = [ receives[:]
+                                      for receives in self.debt_receives ]
+        runinstance.missed_receives = self.missed_receives
+        return runinstance
+
+    def set_state(self, runinstance):
+        """ Continue from the state of another run instance; the state is
+        taken over, so 'runinstance' should not be used anymore (e.g. it is
+        a snapshot).
+        """
+        self.net = runinstance.net
+        self.net_instances = runinstance.net_instances
+        self.activites = runinstance.activites
+        self.packets = runinstance.packets
+        self.debt_receives = runinstance.debt_receives
+        self.missed_receives = runinstance.missed_receives
+
     def get_perspectives(self):
         perspectives = [ Perspective("All", self, self.net_instances) ]
         v = self.net_instances.keys()
@@ -297,6 +349,13 @@ class NetInstance:
         netinstance.enabled_transitions = copy(self.enabled_transitions)
         return netinstance
 
+    def snapshot(self):
+        netinstance = NetInstance(self.process_id, copy_lists(self.tokens))
+        netinstance.enabled_transitions = copy(self.enabled_transitions)
+        netinstance.new_tokens = copy_lists(self.new_tokens)
+        netinstance.removed_tokens = copy_lists(self.removed_tokens)
+        return netinstance
+
 
 class Perspective(utils.EqMixin):
 
@@ -411,3 +470,7 @@ class Perspective(utils.EqMixin):
     def get_process_ids(self):
        return [ net_instance.process_id
                 for net_instance in self.net_instances.values() ]
+
+
+def copy_lists(dictionary):
+    return dict((key, copy(value)) for key, value in dictionary.items())
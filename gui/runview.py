@@ -20,46 +20,125 @@
 
 
 import gtk
+import operator
+import numpy as np
+import gobject
+import traceback
+from threading import Thread, Lock
 import charts
 import utils
 import netview
+import settingswindow
+from mainwindow import Tab
+from tracelog import TraceLog
+from table import Table
 from exportri import place_counter_name
 
 class RunView(gtk.VBox):
 
+    # How often (in miliseconds) a followed tracelog is checked for new events
+    follow_interval = 1000
+    # Charts of tables with more rows are first prepared from a sample of rows
+    preview_rows = 100000
+
     def __init__(self, app, tracelog):
         gtk.VBox.__init__(self)
+        self.app = app
         self.tracelog = tracelog
+        self.follow_source = None
+        self.charts_thread = None
 
         button = gtk.Button("Export sequence")
         button.connect("clicked", lambda w:
                 app.save_sequence_into_project(self.export_sequence()))
+        # A sequence has to start at the beginning of the run
+        button.set_sensitive(not tracelog.is_windowed())
+
+        window_button = gtk.Button("Time window")
+        window_button.connect("clicked", lambda w: self.open_time_window(app))
 
-        self.netinstance_view = netview.NetView(app, None, other_widgets=[button])
+        self.netinstance_view = netview.NetView(
+            app, None, other_widgets=[button, window_button])
         self.netinstance_view.set_config(
             netview.NetViewCanvasConfig(self.netinstance_view))
         self.netinstance_view.set_runinstance(tracelog.first_runinstance)
 
-        table = tracelog.data
-
-        net = tracelog.project.nets[0]
-        processes = range(tracelog.process_count)
-        transitions = [ t for t in net.transitions() if t.trace_fire ]
-        places = [ p for p in net.places() if p.trace_tokens ]
-
         self.views = [ ("Replay", self.netinstance_view) ]
-        self.views.append(process_utilization(table, processes))
-        self.views.append(transition_utilization(table, processes, transitions))
-        self.views.append(tet_per_processes_and_transitions_histogram(
-            table, processes, transitions))
-        self.views.append(tet_per_processes_histogram(table, processes))
-        self.views.append(tet_per_transitions_histogram(table, transitions))
-        self.views.append(tokens_count(table, processes, places))
+        self.views += self._create_charts()
 
         self.pack_start(self._controlls(), False, False)
         for name, item in self.views:
             self.pack_start(item)
 
+        self.connect("destroy", lambda w: self._stop_follow_timer())
+        self.connect("destroy", lambda w: self._stop_charts_thread())
+        if tracelog.is_following():
+            self._start_follow_timer()
+
+    def _create_charts(self):
+        preparations = chart_preparations(self.tracelog)
+        names = [ name for name, prepare in preparations ]
+        # Jobs of the thread are pairs (index of the view, preview)
+        jobs = [ (i + 1, False) for i in xrange(len(preparations)) ]
+
+        # Charts of a large table are first prepared from every n-th row,
+        # charts of all rows replace the previews later
+        table = self.tracelog.data
+        step = (len(table) + self.preview_rows - 1) // self.preview_rows
+        if step > 1:
+            sample = Table.create_from_data(table.data[::step])
+            preparations = chart_preparations(self.tracelog, sample, step) \
+                           + preparations
+            jobs = [ (i, True) for i, preview in jobs ] + jobs
+
+        # Data of charts are prepared in the background, placeholders are
+        # shown until charts are created; results of a replaced thread
+        # are ignored
+        self._stop_charts_thread()
+        self.chart_jobs = jobs
+        thread = ChartsThread(
+            [ prepare for name, prepare in preparations ],
+            lambda index, create_chart:
+                self._chart_prepared(thread, index, create_chart))
+        self.charts_thread = thread
+        self.charts_thread.start()
+        return [ (name, ChartPlaceholder(self.cancel_charts))
+                 for name in names ]
+
+    def _chart_prepared(self, thread, index, create_chart):
+        if thread is not self.charts_thread:
+            return
+        view_index, preview = self.chart_jobs[index]
+        name, placeholder = self.views[view_index]
+        if not isinstance(placeholder, ChartPlaceholder):
+            return
+        if create_chart is None:
+            placeholder.stop("The chart is not available")
+            return
+        widget = create_chart()
+        if preview:
+            placeholder.set_preview(widget)
+            return
+        placeholder.stop("")
+        position = self.child_get_property(placeholder, "position")
+        self.remove(placeholder)
+        self.pack_start(widget)
+        self.reorder_child(widget, position)
+        self.views[view_index] = (name, widget)
+        self._view_change(self.views_combo)
+
+    def cancel_charts(self):
+        """ Stop the preparation of charts that are not created yet """
+        self._stop_charts_thread()
+        for name, item in self.views:
+            if isinstance(item, ChartPlaceholder):
+                item.stop("The preparation of the chart was cancelled")
+
+    def _stop_charts_thread(self):
+        # A cancelled thread finishes the current preparation
+        if self.charts_thread is not None:
+            self.charts_thread.cancel()
+
     def _controlls(self):
         self.scale = gtk.HScale(gtk.Adjustment(value=0, lower=0,
             upper=self.tracelog.get_runinstances_count(), step_incr=1, page_incr=1, page_size=1))
@@ -71,6 +150,7 @@ class RunView(gtk.VBox):
         combo.set_active(0)
         combo.connect("changed", self._view_change)
         toolbar.pack_start(combo, False, False)
+        self.views_combo = combo
 
         button = gtk.Button("<<")
         button.connect("clicked", lambda w: self.scale.set_value(max(0, self.get_event_index() - 1)))
@@ -93,6 +173,12 @@ class RunView(gtk.VBox):
         self.info_label = gtk.Label()
         toolbar.pack_start(self.info_label, False, False)
 
+        button = gtk.CheckButton("Follow")
+        button.set_active(self.tracelog.is_following())
+        button.set_sensitive(not self.tracelog.is_windowed())
+        button.connect("toggled", lambda w: self.set_follow(w.get_active()))
+        toolbar.pack_start(button, False, False)
+
         self.update_labels()
         toolbar.show_all()
         return toolbar
@@ -109,6 +195,114 @@ class RunView(gtk.VBox):
     def export_sequence(self):
         return self.tracelog.export_sequence(self.get_event_index())
 
+    def set_follow(self, follow):
+        """ Start or stop following of a tracelog that is still being
+        written. A tracelog that is not followed is loaded again.
+        """
+        if follow == self.tracelog.is_following():
+            return
+        if follow:
+            tracelog = self.app._catch_io_error(
+                lambda: TraceLog(self.tracelog.filename, True, follow=True))
+            if tracelog is None:
+                return
+            self.tracelog = tracelog
+            self.refresh()
+            self._start_follow_timer()
+        else:
+            self._stop_follow_timer()
+            # The table cannot be changed while charts are prepared; a
+            # cancelled thread only finishes the current preparation
+            self._stop_charts_thread()
+            if self.charts_thread is not None:
+                self.charts_thread.join()
+            self.tracelog.stop_following()
+            self.refresh()
+
+    def refresh(self):
+        """ Update the view after events were added into the tracelog """
+        adjustment = self.scale.get_adjustment()
+        at_end = self.get_event_index() >= adjustment.get_upper() - 1
+        count = self.tracelog.get_runinstances_count()
+        adjustment.set_upper(count)
+        if at_end:
+            index = count - 1
+        else:
+            index = min(self.get_event_index(), count - 1)
+        if index != self.get_event_index():
+            self.scale.set_value(index)
+        else:
+            self.show_runinstance()
+
+        # Charts are replaced in place, the selected view stays visible;
+        # the preparation of old charts is stopped first
+        self.cancel_charts()
+        for name, item in self.views[1:]:
+            self.remove(item)
+        self.views[1:] = self._create_charts()
+        for name, item in self.views[1:]:
+            self.pack_start(item)
+        self._view_change(self.views_combo)
+
+    def _follow(self):
+        # The table cannot be changed while charts are prepared
+        if self.charts_thread is not None and self.charts_thread.is_alive():
+            return True
+        if self.tracelog.update():
+            self.refresh()
+        return True
+
+    def _start_follow_timer(self):
+        self.follow_source = gobject.timeout_add(self.follow_interval,
+                                                 self._follow)
+
+    def _stop_follow_timer(self):
+        if self.follow_source is not None:
+            gobject.source_remove(self.follow_source)
+            self.follow_source = None
+
+    def open_time_window(self, app):
+        """ Load only events inside a time range of the tracelog and show
+        them in a new tab.
+        """
+        def validator(value):
+            if value < 0:
+                return "The time must not be negative."
+            return None
+
+        sw = settingswindow.SettingWidget()
+        sw.add_entry("start", "Start time (ns)",
+                     self.tracelog.get_event_time(self.get_event_index()),
+                     validator, int)
+        sw.add_entry("end", "End time (ns)",
+                     self.tracelog.get_max_time(), validator, int)
+
+        dialog = settingswindow.BasicSettingDialog(sw, "Time window", app.window)
+        dialog.set_size_request(400, 150)
+        dialog.add_button(gtk.STOCK_CANCEL, gtk.RESPONSE_CANCEL)
+        dialog.add_button(gtk.STOCK_OK, gtk.RESPONSE_OK, True)
+
+        response = dialog.run()
+        dialog.destroy()
+        if response != gtk.RESPONSE_OK:
+            return
+
+        start = dialog.get_setting("start")
+        end = dialog.get_setting("end")
+        if start > end:
+            app.show_error_dialog("The start time is behind the end time.")
+            return
+
+        # The state at the start is replayed from the nearest snapshot of
+        # this tracelog; the window is loaded in the background
+        filename = self.tracelog.filename
+        snapshot = self.tracelog.get_snapshot_before(start)
+        name = "Tracelog ({0} - {1})".format(utils.time_to_string(start),
+                                            utils.time_to_string(end))
+        app.window.add_tab(Tab(name, RunViewLoader(
+            app, lambda: TraceLog(filename, True, time_range=(start, end),
+                                  snapshot=snapshot))))
+
     def _view_change(self, w):
         text = w.get_active_text()
         for name, item in self.views:
@@ -143,6 +337,166 @@ class RunView(gtk.VBox):
             time)
         self.info_label.set_markup(text)
 
+def chart_preparations(tracelog, table=None, scale=1):
+    """ Return a list of couples (name, preparation) for charts of the
+    tracelog; a preparation returns a function creating the chart, or None
+    when the chart cannot be created (see ChartsThread).
+
+    Arguments:
+    tracelog -- a tracelog
+    table -- a table used instead of the table of the tracelog, e.g. a sample
+    of its rows
+    scale -- counts in histograms are multiplied by it
+    """
+    if table is None:
+        table = tracelog.data
+
+    net = tracelog.project.nets[0]
+    processes = range(tracelog.process_count)
+    transitions = [ t for t in net.transitions() if t.trace_fire ]
+    places = [ p for p in net.places() if p.trace_tokens ]
+
+    return [
+        ("Utilization of processes",
+         lambda: process_utilization(table, processes)),
+        ("Utilization of transitions",
+         lambda: transition_utilization(table, processes, transitions)),
+        ("Transition execution times (TETs)",
+         lambda: tet_per_processes_and_transitions_histogram(
+             table, processes, transitions, scale)),
+        ("TETs (grouped by processes)",
+         lambda: tet_per_processes_histogram(table, processes, scale)),
+        ("TETs (grouped by transitions)",
+         lambda: tet_per_transitions_histogram(table, transitions, scale)),
+        ("Number of tokens",
+         lambda: tokens_count(table, processes, places)) ]
+
+class ChartsThread(Thread):
+
+    """ Prepares data of charts in the background. Each preparation returns
+    a function which creates the chart widget, or None when the chart cannot
+    be created. The function is passed to the callback (together with the
+    index of the preparation) in the main loop.
+    """
+
+    def __init__(self, preparations, callback):
+        Thread.__init__(self)
+        self.preparations = preparations
+        self.callback = callback
+        self.lock = Lock()
+        self.cancelled = False
+        self.daemon = True
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+
+    def is_cancelled(self):
+        with self.lock:
+            return self.cancelled
+
+    def run(self):
+        for i, prepare in enumerate(self.preparations):
+            if self.is_cancelled():
+                return
+            try:
+                create_chart = prepare()
+            except Exception:
+                traceback.print_exc()
+                create_chart = None
+            gobject.idle_add(self._finish, i, create_chart)
+
+    def _finish(self, index, create_chart):
+        if not self.is_cancelled():
+            self.callback(index, create_chart)
+        return False
+
+class ChartPlaceholder(gtk.VBox):
+
+    """ Shown instead of a chart until data of the chart are prepared """
+
+    def __init__(self, cancel_callback, text="Preparing the chart ..."):
+        gtk.VBox.__init__(self)
+        box = gtk.HBox()
+        self.progressbar = gtk.ProgressBar()
+        self.progressbar.set_text(text)
+        box.pack_start(self.progressbar)
+        self.button = gtk.Button("Cancel")
+        self.button.connect("clicked", lambda w: cancel_callback())
+        box.pack_start(self.button, False, False)
+        self.pack_start(box, False, False)
+        self.preview = None
+
+        self.pulse_source = gobject.timeout_add(100, self._pulse)
+        self.connect("destroy", lambda w: self.stop(""))
+
+    def _pulse(self):
+        self.progressbar.pulse()
+        return True
+
+    def set_preview(self, widget):
+        """ Show a coarse chart below the progress bar until the chart
+        is prepared.
+        """
+        if self.preview is not None:
+            self.remove(self.preview)
+        self.preview = widget
+        self.pack_start(widget)
+        widget.show_all()
+        self.progressbar.set_text("Preview from a sample of rows; "
+                                  "preparing the chart ...")
+
+    def stop(self, text):
+        if self.pulse_source is not None:
+            gobject.source_remove(self.pulse_source)
+            self.pulse_source = None
+        self.progressbar.set_fraction(0)
+        self.progressbar.set_text(text)
+        self.button.set_sensitive(False)
+
+class RunViewLoader(gtk.VBox):
+
+    """ Loads a tracelog in the background (see ChartsThread) and shows it
+    in a RunView when it is loaded; 'load' returns the tracelog.
+    """
+
+    def __init__(self, app, load):
+        gtk.VBox.__init__(self)
+        self.app = app
+        self.load = load
+        self.error = None
+        self.placeholder = ChartPlaceholder(self.cancel,
+                                            "Loading the tracelog ...")
+        self.pack_start(self.placeholder)
+        self.thread = ChartsThread([ self._load ], self._loaded)
+        self.thread.start()
+        self.connect("destroy", lambda w: self.thread.cancel())
+        self.placeholder.show_all()
+
+    def cancel(self):
+        self.thread.cancel()
+        self.placeholder.stop("The loading was cancelled")
+
+    def _load(self):
+        try:
+            tracelog = self.load()
+        except EnvironmentError as e:
+            self.error = str(e)
+            return None
+        return lambda: RunView(self.app, tracelog)
+
+    def _loaded(self, index, create_view):
+        if create_view is None:
+            self.placeholder.stop("The tracelog is not available")
+            if self.error is not None:
+                self.app.show_error_dialog(self.error)
+            return
+        self.placeholder.stop("")
+        self.remove(self.placeholder)
+        view = create_view()
+        self.pack_start(view)
+        view.show()
+
 def process_utilization(table, processes):
     required = ["Event", "Process", "Time", "Duration"]
     header = table.header
@@ -150,30 +504,24 @@ def process_utilization(table, processes):
     if not all(item in header for item in required):
         return
 
-    f_eq = lambda x, y: x == y
-
     columns = ["Time", "Duration"]
+    groups = table.groupby(["Event", "Process"], columns)
     # collect idles
-    filters = [("Event", f_eq, 'I')]
-    idles = []
-    for p in processes:
-        idles.append(table.select(columns, filters + [("Process", f_eq, p)]))
+    idles = [groups[('I', p)] for p in processes]
 
     # collect TETs
-    filters = [("Event", f_eq, 'T')]
     names, values = [], []
     for p in processes:
         names.append(str(p))
-        values.append(table.select(columns, filters + [("Process", f_eq, p)]))
+        values.append(groups[('T', p)])
 
     names.reverse()
     values.reverse()
     if idles is not None:
         idles.reverse()
-    return ("Utilization of processes",
-            charts.utilization_chart(
-                names, values,
-                "Utilization of processes", "Time", "Process", idles))
+    return lambda: charts.utilization_chart(
+        names, values,
+        "Utilization of processes", "Time", "Process", idles)
 
 def transition_utilization(table, processes, transitions):
     required = ["Event", "ID", "Time", "Duration"]
@@ -182,18 +530,16 @@ def transition_utilization(table, processes, transitions):
     if not all(item in header for item in required):
         return
 
-    f_eq = lambda x, y: x == y
     columns = ["Time", "Duration"]
-    filters = [("Event", f_eq, 'T')]
+    filters = [("Event", operator.eq, 'T')]
     if "Process" in header:
+        groups = table.groupby(["ID", "Process"], columns, filters)
         names, values = [], []
         for p in processes:
             pnames, pvalues = [], []
             for t in transitions:
                 pnames.append("{0} {1}".format(t.get_name_or_id(), p))
-                pvalues.append(table.select(
-                    columns,
-                    filters + [("ID", f_eq, t.id), ("Process", f_eq, p)]))
+                pvalues.append(groups[(t.id, p)])
             names.append(pnames)
             values.append(pvalues)
 
@@ -205,90 +551,78 @@ def transition_utilization(table, processes, transitions):
         values = reduce(f_concate, values, [])
         names = reduce(f_concate, names, [])
     else:
+        groups = table.groupby("ID", columns, filters)
         names, values = [], []
         for t in transitions:
             names.append(t.get_name_or_id())
-            values.append(table.select(
-                columns, filters + [("ID", f_eq, t.id)]))
-
-    return ("Utilization of transitions",
-            charts.utilization_chart(
-                names, values,
-                "Utilization of transitions", "Time", "Transition"))
+            values.append(groups[t.id])
+
+    return lambda: charts.utilization_chart(
+        names, values,
+        "Utilization of transitions", "Time", "Transition")
+
+def tet_histograms(table, keys, groups, scale=1):
+    """ Return counts of transition execution times in bins for the groups
+    and edges of the bins; histograms are cached by the table. Counts are
+    multiplied by 'scale'.
+    """
+    filters = [("Event", operator.eq, 'T')]
+    histograms = table.histogram("Duration", keys, filters=filters)
+    if histograms:
+        edges = histograms.values()[0][1]
+    else:
+        edges = np.linspace(0, 1, 11)
+    empty = np.zeros(len(edges) - 1, dtype=int)
+    return [ histograms[key][0] * scale if key in histograms else empty
+             for key in groups ], edges
 
-def tet_per_processes_and_transitions_histogram(table, processes, transitions):
+def tet_per_processes_and_transitions_histogram(table, processes, transitions,
+                                                 scale=1):
     required = ["Event", "Process", "Duration", "ID"]
     header = table.header
 
     if not all(item in header for item in required):
        return
 
-    f_eq = lambda x, y: x == y
-    columns = ["Duration"]
-    filters = [("Event", f_eq, 'T')]
-    names, values = [], []
+    names, groups = [], []
     for tran in transitions:
-        f = filters + [("ID", f_eq, tran.id)]
         for p in processes:
             names.append("{0}`{1}".format(tran.get_name_or_id(), p))
-            tets = table.select(columns, f + [("Process", f_eq, p)])
-
-            if len(tets) == 0: # tets is a numpy array
-                tets = [0] # data for a histogram chart must not be empty
-            values.append(tets)
+            groups.append((tran.id, p))
+    values, edges = tet_histograms(table, ["ID", "Process"], groups, scale)
 
-    return ("Transition execution times (TETs)",
-            charts.histogram(
-                names, values, "Histogram of transition execution times",
-                "Duration [ms]", "Count"))
+    return lambda: charts.histogram(
+        names, values, "Histogram of transition execution times",
+        "Duration [ms]", "Count", edges)
 
-def tet_per_processes_histogram(table, processes):
+def tet_per_processes_histogram(table, processes, scale=1):
     required = ["Event", "Process", "Duration"]
     header = table.header
 
     if not all(item in header for item in required):
        return
 
-    f_eq = lambda x, y: x == y
-    columns = ["Duration"]
-    filters = [("Event", f_eq, 'T')]
-    names, values = [], []
-    for p in processes:
-        names.append("Process {0}".format(p))
-        tets = table.select(columns, filters + [("Process", f_eq, p)])
+    names = [ "Process {0}".format(p) for p in processes ]
+    values, edges = tet_histograms(table, "Process", processes, scale)
 
-        if len(tets) == 0:
-            tets = [0]
-        values.append(tets)
+    return lambda: charts.histogram(
+        names, values, "Histogram of transition execution times grouped by processes",
+        "Duration [ms]", "Count", edges)
 
-    return ("TETs (grouped by processes)",
-            charts.histogram(
-                names, values, "Histogram of transition execution times grouped by processes",
-                "Duration [ms]", "Count"))
-
-def tet_per_transitions_histogram(table, transitions):
+def tet_per_transitions_histogram(table, transitions, scale=1):
     required = ["Event", "Duration", "ID"]
     header = table.header
 
     if not all(item in header for item in required):
        return
 
-    f_eq = lambda x, y: x == y
-    columns = ["Duration"]
-    filters = [("Event", f_eq, 'T')]
-    names, values = [], []
-    for t in transitions:
-        names.append(t.get_name_or_id())
-        tets = table.select(columns, filters + [("ID", f_eq, t.id)])
-
-        if len(tets) == 0:
-            tets = [0]
-        values.append(tets)
+    names = [ t.get_name_or_id() for t in transitions ]
+    values, edges = tet_histograms(
+        table, "ID", [ t.id for t in transitions ], scale)
 
-    return ("TETs (grouped by transitions)",
-            charts.histogram(
-                names, values, "Histogram of transition execution times grouped by transitions",
-                "Duration [ms]", "Count"))
+    return lambda: charts.histogram(
+        names, values, "Histogram of transition execution times grouped by transitions",
+        "Duration [ms]", "Count", edges)
 
 def tokens_count(table, processes, places, collapse=True):
     required = ["Event", "Process", "Time"] + \
@@ -298,19 +632,18 @@ def tokens_count(table, processes, places, collapse=True):
     if not all(item in header for item in required):
         return
 
-    f_eq = lambda x, y: x == y
-    filters = [("Event", f_eq, 'C')]
+    filters = [("Event", operator.eq, 'C')]
+    columns = ["Time"] + [place_counter_name(place) for place in places]
+    groups = table.groupby("Process", columns, filters)
     names, values = [], []
     for place in places:
-        columns = ["Time", place_counter_name(place)]
         for p in processes:
             names.append("{0}@{1}".format(place.get_name_or_id(), p))
-            counts = table.select(columns, filters + [("Process", f_eq, p)])
-            values.append((counts[columns[0]], counts[columns[1]]))
+            counts = groups[p]
+            values.append((counts["Time"], counts[place_counter_name(place)]))
 
-    return ("Number of tokens",
-            charts.place_chart(
-                names, values, "Number of tokens in places", "Time", "Count"))
+    return lambda: charts.place_chart(
+        names, values, "Number of tokens in places", "Time", "Count")
 
 
 
@@ -18,18 +18,46 @@
 #
 
 import numpy as np
+import operator
+import os
+import io
+import shutil
+import atexit
+import weakref
+import tempfile
+from functools import partial
+
+# scratch directories of tables, keys are weak references to the tables
+scratch_directories = {}
+
+def remove_scratch_directory(ref):
+    shutil.rmtree(scratch_directories.pop(ref), ignore_errors=True)
+
+@atexit.register
+def remove_scratch_directories():
+    for ref in scratch_directories.keys():
+        remove_scratch_directory(ref)
 
 class Table(object):
 
-    def __init__(self, columns, rows_number=10, init_data=True):
+    def __init__(self, columns, rows_number=10, init_data=True, directory=None):
         """ An initialization of a table.
         Note: there should not be used general PyObject type ('O' description),
         because of an error in NumPy indexing. (The `select` method would not
         work).
 
+        Values and masks of invalid values are stored in separate arrays with
+        a reserve of rows; the reserve grows twice when it is exhausted.
+        They can be kept in memory-mapped .npy files, then appending rows,
+        queries, `get_column` and iteration do not load the whole table into
+        memory. The scratch directory with the files is removed by `close`,
+        or when the table is released.
+
         Arguments:
         columns -- a list of couples (name, data type)
         rows_number -- an initializing number of rows
+        directory -- a scratch directory for files of the table, None keeps
+        the table in memory
         """
         self.columns_number = len(columns)
         if not columns:
@@ -38,11 +66,32 @@ class Table(object):
         else:
             self.header, self.types = map(list, zip(*columns))
         self.rows_number = rows_number
+        self.indexed_columns = []
+        self.indexes = {}
+        self.histograms = {}
+        self.directory = None
+        if directory is not None:
+            self.directory = tempfile.mkdtemp(prefix="table-", dir=directory)
+            scratch_directories[weakref.ref(self, remove_scratch_directory)] = \
+                self.directory
         if init_data:
-            self.data = np.ma.zeros((self.rows_number,), dtype=columns)
+            dtype = np.dtype(columns)
+            if self.directory is not None and dtype.hasobject:
+                raise Exception(
+                    "Values of 'object' type cannot be stored in a file.")
+            self.values = self._allocate("values", dtype)
+            self.mask = self._allocate("mask", np.ma.make_mask_descr(dtype))
 
         self.last_row_index = 0
 
+    def close(self):
+        """ Remove the scratch directory of the table; the table cannot be
+        used after that.
+        """
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
     @classmethod
     def create_from_data(cls, data):
         assert isinstance(data, np.ma.core.MaskedArray), \
@@ -50,15 +99,54 @@ class Table(object):
 
         columns = data.dtype.descr
         rows_number = len(data)
-        t = Table(columns, rows_number)
-        if isinstance(data, np.ma.core.MaskedArray):
-            t.data = data
-        else:
-            t.data = np.ma.zeros((rows_number,), dtype=columns)
-            t.data.data = data
-        t.last_row_index = rows_number
+        t = Table(columns, rows_number, False)
+        t.data = data
         return t
 
+    @classmethod
+    def create_from_arrays(cls, values, mask):
+        """ Create a table over a structured array of values and an array
+        of masks of invalid values; arrays are not copied.
+        """
+        t = Table(values.dtype.descr, len(values), False)
+        t.values = values
+        t.mask = mask
+        t.last_row_index = len(values)
+        return t
+
+    @classmethod
+    def from_columns(cls, columns, data, valid=None):
+        """ Create a table from whole columns.
+
+        Arguments:
+        columns -- a list of couples (name, data type)
+        data -- a list of arrays with values of columns
+        valid -- a list of boolean arrays where False marks an invalid
+        value; None instead of the list or instead of an array means that
+        all values are valid
+        """
+        t = Table(columns, len(data[0]) if data else 0)
+        t.extend(data, valid)
+        return t
+
+    def get_data(self):
+        """ Return rows of the table as a masked array; it is a view, values
+        are not copied.
+        """
+        return np.ma.array(self.values[:self.last_row_index],
+                           mask=self.mask[:self.last_row_index],
+                           copy=False)
+
+    def set_data(self, data):
+        self.indexes = {}
+        self.histograms = {}
+        self.values = np.ma.getdata(data)
+        self.mask = np.ma.getmaskarray(data)
+        self.rows_number = len(data)
+        self.last_row_index = len(data)
+
+    data = property(get_data, set_data)
+
     def __getitem__(self, key):
         return self.data[key]
 
@@ -74,7 +162,7 @@ class Table(object):
             raise StopIteration
 
         # returns modified data; masked values are replaced by None
-        data, mask = self.data.data[self._index], self.data.mask[self._index]
+        data, mask = self.values[self._index], self.mask[self._index]
         try:
             ndata, nmask = iter(data), iter(mask)
             raw_data = zip(data, mask)
@@ -92,26 +180,122 @@ class Table(object):
         assert len(row) == self.columns_number, \
                "The row has to have the same length as the table has columns."
 
-        if self.last_row_index >= self.rows_number: # resize
-            self.rows_number *= 2
-            self.data = np.ma.resize(self.data, self.rows_number)
-
+        self.reserve(self.last_row_index + 1)
+        self.indexes = {}
+        self.histograms = {}
         for i, item in enumerate(row): # append row
             if item is None: # invalid values
-                self.data.mask[self.last_row_index][i] = True
+                self.mask[self.last_row_index][i] = True
             else:
-                self.data.mask[self.last_row_index][i] = False
-                self.data.data[self.last_row_index][i] = item
+                self.mask[self.last_row_index][i] = False
+                self.values[self.last_row_index][i] = item
         self.last_row_index += 1
 
+    def add_rows(self, rows):
+        """ Append a batch of rows; None is an invalid value. """
+        if not rows:
+            return
+        assert all(len(row) == self.columns_number for row in rows), \
+               "The row has to have the same length as the table has columns."
+        data, valid = zip(*[ to_column(values, dtype)
+                             for values, dtype in zip(zip(*rows), self.types) ])
+        self.extend(data, valid)
+
+    def extend(self, data, valid=None):
+        """ Append rows given by columns.
+
+        Arguments:
+        data -- a list of arrays with values of columns
+        valid -- a list of boolean arrays where False marks an invalid
+        value; None instead of the list or instead of an array means that
+        all values are valid
+        """
+        assert len(data) == self.columns_number, \
+               "The number of columns does not match."
+        if not data:
+            return
+        if valid is None:
+            valid = [None] * len(data)
+
+        start = self.last_row_index
+        end = start + len(data[0])
+        self.reserve(end)
+        self.indexes = {}
+        self.histograms = {}
+        for name, values, column_valid in zip(self.header, data, valid):
+            self.values[name][start:end] = values
+            if column_valid is None:
+                self.mask[name][start:end] = False
+            else:
+                self.mask[name][start:end] = np.logical_not(column_valid)
+        self.last_row_index = end
+
+    def reserve(self, rows_number):
+        """ Make place for at least 'rows_number' rows """
+        if rows_number <= len(self.values):
+            return
+        self.rows_number = max(rows_number, 2 * len(self.values))
+        self._resize()
+
     def trim(self):
-        self.data = np.ma.resize(self.data, self.last_row_index)
+        self.rows_number = self.last_row_index
+        self._resize()
+
+    def _allocate(self, name, dtype):
+        if self.directory is None:
+            return np.zeros((self.rows_number,), dtype=dtype)
+        return np.lib.format.open_memmap(
+            os.path.join(self.directory, name + ".npy"),
+            "w+", dtype, (self.rows_number,))
+
+    def _resize(self):
+        if self.directory is None:
+            self.values = resize(
+                self.values, self.rows_number, self.last_row_index)
+            self.mask = resize(
+                self.mask, self.rows_number, self.last_row_index)
+        else:
+            self.values = resize_file(self.values, self.rows_number)
+            self.mask = resize_file(self.mask, self.rows_number)
 
     def get_column(self, column):
-        return self.data.data[self._get_colum_name(column)]
+        return self.values[self._get_colum_name(column)][:self.last_row_index]
+
+    def create_index(self, column="Time"):
+        """ Keep a sorted index on a column. Filters of `select` comparing
+        the indexed column by operator.eq, lt, le, gt or ge are answered by
+        a binary search instead of a scan of the whole table. The index is
+        built at the first query and again after the table is changed.
+
+        Arguments:
+        column -- a name or index of a column
+        """
+        name = self._get_colum_name(column)
+        if name not in self.indexed_columns:
+            self.indexed_columns.append(name)
+
+    def get_index(self, column):
+        """ Return a couple (rows, values), where values are sorted valid
+        values of an indexed column and rows are their row indexes.
+        """
+        name = self._get_colum_name(column)
+        index = self.indexes.get(name)
+        if index is None:
+            rows = np.flatnonzero(~self.mask[name][:self.last_row_index])
+            values = self.values[name][rows]
+            if np.any(values[1:] < values[:-1]):
+                order = np.argsort(values, kind="mergesort")
+                rows, values = rows[order], values[order]
+            index = (rows, values)
+            self.indexes[name] = index
+        return index
+
+    def query(self):
+        """ Return a lazy query over all rows of the table (see Query). """
+        return Query(self)
 
     def select(self, columns=None, filters=[]):
-        """ Select columns and filter data.
+        """ Select columns and filter data; it is a shortcut for a query.
 
         Arguments:
         columns -- a list of names or indexes of columns
@@ -119,23 +303,226 @@ class Table(object):
         index of column, the second one is a compare function, and the last
         is compared value.
         """
+        if not isinstance(filters, list):
+            filters = [filters]
+
+        query = self.query()
+        for col, f_cmp, value in filters:
+            query = query.where(col, f_cmp, value)
         if columns is not None:
             if not isinstance(columns, list):
                 columns = [columns]
-            columns = [self._get_colum_name(column) for column in columns]
+            if len(columns) == 1:
+                columns = columns[0]
+            query = query.select(columns)
+        return query.execute()
+
+    def _find_bounds(self, name, f_cmp, value):
+        values = self.get_index(name)[1]
+        left, right = index_bounds[f_cmp]
+        start = 0 if left is None else values.searchsorted(value, left)
+        end = len(values) if right is None else values.searchsorted(value, right)
+        return (start, end)
+
+    def aggregate(self, function, column, keys=None, filters=[], **options):
+        """ Aggregate valid values of a column in one pass by NumPy
+        reductions.
 
+        Arguments:
+        function -- "count", "sum", "min", "max", "mean", "quantiles" (option
+        q, a quantile or a list of them) or "histogram" (options bins and
+        range); see also Groups.aggregate
+        column -- a name or index of a column
+        keys -- key columns of groups (see `groupby`); if it is None, the
+        result for all rows is returned, otherwise a dictionary of results
+        for groups
+        filters -- the same as in `select`
+        """
+        if keys is not None:
+            return self.groupby(keys, column, filters).aggregate(
+                function, **options)
+        data = self.select(column, filters)
+        if not len(data):
+            data = np.ma.array(np.zeros(1, data.dtype), mask=True)
+        groups = Groups([None], data, np.zeros(1, dtype=int))
+        return groups.aggregate(function, **options)[None]
+
+    def histogram(self, column, keys, bins=10, range=None, filters=[]):
+        """ Return a dictionary with a couple (counts, edges) for each group
+        of rows; all groups share the same bins (see `aggregate`). Results
+        are cached until rows of the table are changed.
+
+        Arguments:
+        column -- a name or index of a column
+        keys -- key columns of groups (see `groupby`)
+        bins -- the number of bins
+        range -- a couple (low, high); by default it is given by the minimal
+        and the maximal value of the column
+        filters -- the same as in `select`
+        """
         if not isinstance(filters, list):
             filters = [filters]
+        key = (column, tuple(keys) if isinstance(keys, list) else keys,
+               bins, range, tuple(filters))
+        result = self.histograms.get(key)
+        if result is None:
+            result = self.aggregate(
+                "histogram", column, keys, filters, bins=bins, range=range)
+            self.histograms[key] = result
+        return result
+
+    def join(self, other, keys, other_keys=None, outer=False,
+             suffix=" (2)"):
+        """ Join rows of two tables with equal keys by a sort-merge join.
+        The result has all columns of this table and columns of the other
+        table except its key columns; names that are already used get
+        the suffix. Rows with an invalid key are not joined.
 
-        mask = np.ma.ones(self.last_row_index, dtype='bool')
+        Arguments:
+        other -- the other table
+        keys -- a list of key columns of this table; a couple (column, width)
+        is a key column whose values are divided into buckets of the width
+        (e.g. time buckets)
+        other_keys -- key columns of the other table, the same as keys by
+        default
+        outer -- if True, rows of this table without a matching row are kept
+        with invalid values in columns of the other table
+        """
+        if other_keys is None:
+            other_keys = keys
+        assert len(keys) == len(other_keys), \
+               "The tables must be joined by the same number of keys."
+
+        left_codes, right_codes, count = join_codes(
+            self.get_keys(keys), other.get_keys(other_keys))
+        order = np.argsort(right_codes, kind="mergesort")
+        # rows with the code -1 are counted at the index 0
+        right_counts = np.bincount(right_codes + 1, minlength=count + 1)
+        right_starts = np.cumsum(right_counts) - right_counts
+        starts = right_starts[left_codes + 1]
+        counts = right_counts[left_codes + 1]
+        counts[left_codes < 0] = 0
+        if outer:
+            matched = counts > 0
+            counts[~matched] = 1
+
+        left_rows = np.repeat(np.arange(len(self)), counts)
+        offsets = np.arange(len(left_rows)) - \
+                  np.repeat(np.cumsum(counts) - counts, counts)
+        if len(order):
+            right_rows = order[np.minimum(np.repeat(starts, counts) + offsets,
+                                          len(order) - 1)]
+        else:
+            # the other table is empty, so all rows come from the outer join
+            right_rows = None
+        if outer:
+            right_valid = np.repeat(matched, counts)
+        else:
+            right_valid = np.ones(len(left_rows), dtype=bool)
+
+        columns, data, valid = [], [], []
+        for name, dtype in zip(self.header, self.types):
+            columns.append((name, dtype))
+            data.append(self.values[name][left_rows])
+            valid.append(~self.mask[name][left_rows])
+        other_key_names = [ other._get_colum_name(key[0]
+                                                  if isinstance(key, tuple)
+                                                  else key)
+                            for key in other_keys ]
+        names = set(self.header)
+        for name, dtype in zip(other.header, other.types):
+            if name in other_key_names:
+                continue
+            new_name = name
+            while new_name in names:
+                new_name += suffix
+            names.add(new_name)
+            columns.append((new_name, dtype))
+            if right_rows is None:
+                data.append(np.zeros(len(left_rows), other.values[name].dtype))
+                valid.append(np.zeros(len(left_rows), dtype=bool))
+            else:
+                data.append(other.values[name][right_rows])
+                valid.append(~other.mask[name][right_rows] & right_valid)
+        return Table.from_columns(columns, data, valid)
+
+    def get_keys(self, keys):
+        """ Return a couple (arrays, valid) with values of key columns
+        (see `join`) and a mask of rows with all keys valid.
+        """
+        arrays = []
+        valid = np.ones(len(self), dtype=bool)
+        for key in keys:
+            if isinstance(key, tuple):
+                column, width = key
+            else:
+                column, width = key, None
+            name = self._get_colum_name(column)
+            values = self.get_column(name)
+            if width is not None:
+                values = values // width
+            arrays.append(values)
+            valid &= ~self.mask[name][:len(self)]
+        return (arrays, valid)
+
+    def groupby(self, keys, columns=None, filters=[]):
+        """ Split filtered rows into groups by values of key columns in one
+        pass over the table; rows with an invalid key are left out.
+
+        Arguments:
+        keys -- a name or index of a column, or a list of them
+        columns -- columns of rows in groups; the same as in `select`
+        filters -- the same as in `select`
+        """
+        if not isinstance(keys, list):
+            keys = [keys]
+        keys = [self._get_colum_name(key) for key in keys]
+        if not isinstance(filters, list):
+            filters = [filters]
+
+        # only keys and requested columns are read and sorted
+        query = self.query()
         for col, f_cmp, value in filters:
-            mask &= f_cmp(self.data[self._get_colum_name(col)], value)
+            query = query.where(col, f_cmp, value)
+        if columns is not None:
+            if not isinstance(columns, list):
+                columns = self._get_colum_name(columns)
+                names = [columns]
+            else:
+                columns = [self._get_colum_name(column) for column in columns]
+                names = columns
+            query = query.select(keys + [ name for name in names
+                                          if name not in keys ])
+        data = query.execute()
+
+        invalid = np.zeros(len(data), dtype=bool)
+        for key in keys:
+            invalid |= np.ma.getmaskarray(data[key])
+        order = np.flatnonzero(~invalid)
+
+        # stable sorts from the last key, rows in groups keep their order
+        for key in reversed(keys):
+            values = np.ma.getdata(data[key])[order]
+            order = order[np.argsort(values, kind="mergesort")]
+        data = data[order]
+
+        change = np.zeros(len(data), dtype=bool)
+        change[:1] = True
+        for key in keys:
+            values = np.ma.getdata(data[key])
+            change[1:] |= values[1:] != values[:-1]
+        starts = np.flatnonzero(change)
+
+        key_values = [ np.ma.getdata(data[key])[starts].tolist()
+                       for key in keys ]
+        if len(keys) == 1:
+            key_values = key_values[0]
+        else:
+            key_values = zip(*key_values)
 
-        if columns is None:
-            return self.data[mask]
-        elif len(columns) == 1:
-            columns = columns[0]
-        return self.data[mask][columns]
+        if columns is not None:
+            data = data[columns]
+        return Groups(key_values, data, starts)
 
     def _get_colum_name(self, column):
         if isinstance(column, int) and 0 <= column < self.columns_number:
@@ -145,3 +532,411 @@ class Table(object):
         else:
             raise Exception("Invalid '{0}' column.".format(column))
 
+
+class Query(object):
+
+    # the number of rows tested at once in a scan of the whole table
+    chunk_size = 1 << 20
+
+    def __init__(self, table, filters=(), columns=None, rows_limit=None,
+                 expressions=()):
+        """ A lazy query over a table. Filters, a projection and a limit are
+        collected first; the query is evaluated by `execute`. Filters on
+        indexed columns are answered by the index, the other filters are
+        evaluated only on rows that passed the previous ones, and only
+        projected columns of found rows are copied.
+
+        Arguments:
+        table -- a queried table
+        filters -- a list of triples (column name, compare function, value)
+        columns -- a name of a column, a list of names, or None for all
+        rows_limit -- the maximal number of returned rows, or None
+        expressions -- a list of filter expressions (tablefilter.RowFilter)
+        """
+        self.table = table
+        self.filters = list(filters)
+        self.columns = columns
+        self.rows_limit = rows_limit
+        self.expressions = list(expressions)
+
+    def where(self, column, f_cmp, value):
+        """ Return a query with one more filter; a row is kept if its value
+        is valid and f_cmp(value, compared_value) is True.
+        """
+        filters = self.filters + \
+            [(self.table._get_colum_name(column), f_cmp, value)]
+        return Query(self.table, filters, self.columns, self.rows_limit,
+                     self.expressions)
+
+    def matching(self, expression):
+        """ Return a query with one more filter expression; it is an object
+        with the method evaluate(table, rows) (see tablefilter.RowFilter).
+        """
+        return Query(self.table, self.filters, self.columns, self.rows_limit,
+                     self.expressions + [expression])
+
+    def select(self, columns):
+        """ Return a query with a projection; a single name (not a list)
+        gives a plain column instead of rows.
+        """
+        if isinstance(columns, list):
+            columns = [self.table._get_colum_name(c) for c in columns]
+        else:
+            columns = self.table._get_colum_name(columns)
+        return Query(self.table, self.filters, columns, self.rows_limit,
+                     self.expressions)
+
+    def limit(self, rows_number):
+        """ Return a query returning at most 'rows_number' first rows. """
+        return Query(self.table, self.filters, self.columns, rows_number,
+                     self.expressions)
+
+    def execute(self):
+        """ Return found rows as a masked array. When the rows form a block
+        of the table and all columns or a single column is selected, the
+        result is a view into the table.
+        """
+        table = self.table
+        rows = self._find_rows()
+        if rows is None:
+            start, end = 0, len(table)
+        elif len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            start, end = rows[0], rows[-1] + 1
+            rows = None
+        if rows is None and self.rows_limit is not None:
+            end = min(end, start + self.rows_limit)
+        elif rows is not None and self.rows_limit is not None:
+            rows = rows[:self.rows_limit]
+
+        if rows is None:
+            if self.columns is None:
+                return np.ma.array(table.values[start:end],
+                                   mask=table.mask[start:end], copy=False)
+            rows = slice(start, end)
+
+        if self.columns is None:
+            return np.ma.array(table.values[rows], mask=table.mask[rows])
+        if not isinstance(self.columns, list):
+            return np.ma.array(table.values[self.columns][rows],
+                               mask=table.mask[self.columns][rows],
+                               copy=False)
+
+        types = [ table.types[table.header.index(c)] for c in self.columns ]
+        dtype = np.dtype(zip(self.columns, types))
+        values = np.empty(len(table.values[self.columns[0]][rows]), dtype)
+        mask = np.empty(len(values), np.ma.make_mask_descr(dtype))
+        for name in self.columns:
+            values[name] = table.values[name][rows]
+            mask[name] = table.mask[name][rows]
+        return np.ma.array(values, mask=mask, copy=False)
+
+    def _find_rows(self):
+        """ Return sorted indexes of rows passing filters, or None if there
+        are no filters.
+        """
+        table = self.table
+        bounds = {}
+        scanned_filters = []
+        for name, f_cmp, value in self.filters:
+            if name in table.indexed_columns and f_cmp in index_bounds:
+                start, end = table._find_bounds(name, f_cmp, value)
+                if name in bounds:
+                    start = max(start, bounds[name][0])
+                    end = min(end, bounds[name][1])
+                bounds[name] = (start, max(start, end))
+            else:
+                scanned_filters.append((name, f_cmp, value))
+
+        rows = None
+        for name, (start, end) in bounds.items():
+            found = table.get_index(name)[0][start:end]
+            rows = found if rows is None else np.intersect1d(rows, found)
+        if rows is not None:
+            rows = np.sort(rows)
+
+        # equalities and numeric columns are expected to be cheaper
+        scanned_filters.sort(key=lambda f: (
+            f[1] is not operator.eq, table.values.dtype[f[0]].hasobject))
+        tests = [ partial(self._test, name, f_cmp, value)
+                  for name, f_cmp, value in scanned_filters ]
+        tests += [ partial(expression.evaluate, table)
+                   for expression in self.expressions ]
+        for test in tests:
+            if rows is None:
+                # the first scan goes by chunks, the memory stays bounded
+                # also for tables stored in files
+                rows = [ start + np.flatnonzero(test(
+                             slice(start, min(start + self.chunk_size,
+                                              len(table)))))
+                         for start in xrange(0, len(table), self.chunk_size) ]
+                rows = np.concatenate(rows) if rows else np.zeros(0, int)
+            else:
+                rows = rows[test(rows)]
+            if not len(rows):
+                break
+        return rows
+
+    def _test(self, name, f_cmp, value, rows):
+        values = self.table.values[name][rows]
+        valid = ~self.table.mask[name][rows]
+        return valid & np.asarray(f_cmp(values, value), dtype=bool)
+
+# sides of searchsorted giving bounds of rows found by a compare function
+index_bounds = { operator.eq: ("left", "right"),
+                 operator.lt: (None, "left"),
+                 operator.le: (None, "right"),
+                 operator.gt: ("right", None),
+                 operator.ge: ("left", None) }
+
+class Groups(object):
+
+    def __init__(self, keys, data, starts):
+        """ Groups of rows created by `Table.groupby`.
+
+        Arguments:
+        keys -- a list of values of keys (tuples for more key columns)
+        data -- a masked array with rows sorted by groups
+        starts -- indexes of the first rows of groups
+        """
+        self.data = data
+        self.starts = starts
+        self.ends = np.append(starts[1:], len(data))[:len(starts)]
+        self.group_keys = keys
+        self.indexes = dict((key, i) for i, key in enumerate(keys))
+
+    def __len__(self):
+        return len(self.group_keys)
+
+    def __iter__(self):
+        return iter(self.group_keys)
+
+    def __contains__(self, key):
+        return key in self.indexes
+
+    def __getitem__(self, key):
+        """ Return rows of a group; a missing group has no rows. """
+        i = self.indexes.get(key)
+        if i is None:
+            return self.data[:0]
+        return self.data[self.starts[i]:self.ends[i]]
+
+    def keys(self):
+        return list(self.group_keys)
+
+    def aggregate(self, function, column=None, **options):
+        """ Return a dictionary with a result of the function for each group;
+        invalid values are not passed to the function.
+
+        Arguments:
+        function -- a name of a vectorized aggregation (see `aggregations`),
+        a NumPy ufunc (e.g. np.add), or a function that gets an array of
+        values of a group
+        column -- a column of rows, it is required when rows in groups have
+        more columns
+        options -- options of a vectorized aggregation
+        """
+        data = self.data if column is None else self.data[column]
+        if not len(data):
+            return {}
+        if function in aggregations:
+            results = aggregations[function](
+                data, self.starts, self.ends, **options)
+        elif isinstance(function, np.ufunc) and function.identity is not None:
+            values = np.ma.filled(data, function.identity)
+            results = function.reduceat(values, self.starts).tolist()
+        else:
+            results = [ function(data[start:end].compressed())
+                        for start, end in zip(self.starts, self.ends) ]
+        return dict(zip(self.group_keys, results))
+
+def aggregate_count(data, starts, ends):
+    valid = (~np.ma.getmaskarray(data)).astype(int)
+    return np.add.reduceat(valid, starts).tolist()
+
+def aggregate_sum(data, starts, ends):
+    return np.add.reduceat(np.ma.filled(data, 0), starts).tolist()
+
+def aggregate_min(data, starts, ends):
+    return _reduce_extreme(np.minimum, data, starts, True)
+
+def aggregate_max(data, starts, ends):
+    return _reduce_extreme(np.maximum, data, starts, False)
+
+def aggregate_mean(data, starts, ends):
+    counts = np.array(aggregate_count(data, starts, ends))
+    sums = np.add.reduceat(np.ma.filled(data, 0).astype(float), starts)
+    return [ s / c if c else None for s, c in zip(sums.tolist(), counts) ]
+
+def aggregate_quantiles(data, starts, ends, q=0.5):
+    """ Quantiles are interpolated linearly as by np.percentile; a list
+    of quantiles gives a list for each group.
+    """
+    values = np.ma.getdata(data)
+    invalid = np.ma.getmaskarray(data)
+    groups = np.repeat(np.arange(len(starts)), ends - starts)
+    # valid values of each group are sorted at its beginning
+    values = values[np.lexsort((values, invalid, groups))]
+    counts = np.array(aggregate_count(data, starts, ends))
+
+    results = []
+    for p in np.atleast_1d(q):
+        positions = starts + p * np.maximum(counts - 1, 0)
+        low = np.floor(positions).astype(int)
+        high = np.ceil(positions).astype(int)
+        results.append(values[low] +
+                       (values[high] - values[low]) * (positions - low))
+    results = np.array(results, dtype=float).T.tolist()
+    if np.isscalar(q):
+        results = [ r[0] for r in results ]
+    return [ r if c else None for r, c in zip(results, counts) ]
+
+def aggregate_histogram(data, starts, ends, bins=10, range=None):
+    """ All groups share the same bins, each group gets a couple
+    (counts, edges); bins are set as by np.histogram.
+    """
+    values = np.ma.getdata(data)
+    valid = ~np.ma.getmaskarray(data)
+    if range is None:
+        if valid.any():
+            range = (values[valid].min(), values[valid].max())
+        else:
+            range = (0, 1)
+    low, high = float(range[0]), float(range[1])
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    edges = np.linspace(low, high, bins + 1)
+
+    groups = np.repeat(np.arange(len(starts)), ends - starts)
+    indexes = np.searchsorted(edges, values, "right") - 1
+    indexes[values == high] = bins - 1
+    valid &= (indexes >= 0) & (indexes < bins)
+    counts = np.bincount(groups[valid] * bins + indexes[valid],
+                         minlength=len(starts) * bins)
+    return [ (c, edges) for c in counts.reshape(len(starts), bins) ]
+
+def _reduce_extreme(ufunc, data, starts, minimum):
+    values = np.ma.getdata(data)
+    if values.dtype.kind in "iu":
+        info = np.iinfo(values.dtype)
+        fill = info.max if minimum else info.min
+    else:
+        fill = np.inf if minimum else -np.inf
+    results = ufunc.reduceat(np.ma.filled(data, fill), starts).tolist()
+    counts = aggregate_count(data, starts, None)
+    return [ r if c else None for r, c in zip(results, counts) ]
+
+# vectorized aggregations of `Groups.aggregate` and `Table.aggregate`
+aggregations = { "count": aggregate_count,
+                 "sum": aggregate_sum,
+                 "min": aggregate_min,
+                 "max": aggregate_max,
+                 "mean": aggregate_mean,
+                 "quantiles": aggregate_quantiles,
+                 "histogram": aggregate_histogram }
+
+def join_codes(left, right):
+    """ Return a triple (left_codes, right_codes, count), where codes are
+    integers from 0 to count - 1 and equal keys of both tables get the same
+    code. Invalid keys and keys missing in the other table get -1.
+
+    Arguments:
+    left, right -- couples (arrays, valid) returned by Table.get_keys
+    """
+    # keys of the smaller table are numbered, the other table only looks
+    # its keys up
+    swap = len(left[1]) < len(right[1])
+    (large_arrays, large_valid), (small_arrays, small_valid) = \
+        (right, left) if swap else (left, right)
+
+    small_codes = np.zeros(len(small_valid), dtype=np.int64)
+    large_codes = np.zeros(len(large_valid), dtype=np.int64)
+    unique = small_codes[:1]
+    for small_values, large_values in zip(small_arrays, large_arrays):
+        unique, inverse = np.unique(small_values, return_inverse=True)
+        positions = lookup_codes(unique, large_values)
+        small_codes = small_codes * len(unique) + inverse
+        large_codes = np.where((positions >= 0) & (large_codes >= 0),
+                               large_codes * len(unique) + positions, -1)
+        # codes are renumbered to stay small for the next key
+        unique, small_codes = np.unique(small_codes, return_inverse=True)
+        large_codes = lookup_codes(unique, large_codes)
+
+    small_codes[~small_valid] = -1
+    large_codes[~large_valid] = -1
+    if swap:
+        return (small_codes, large_codes, len(unique))
+    return (large_codes, small_codes, len(unique))
+
+# the maximal range of integer keys that are looked up in a direct table
+lookup_limit = 1 << 22
+
+def lookup_codes(unique, values):
+    """ Return positions of values in a sorted array of unique values, or -1
+    for values that are not there.
+    """
+    codes = np.empty(len(values), dtype=np.int64)
+    codes.fill(-1)
+    if not len(unique):
+        return codes
+    if unique.dtype.kind in "iu" and values.dtype.kind in "iu" and \
+       int(unique[-1]) - int(unique[0]) < lookup_limit:
+        low = int(unique[0])
+        table = np.empty(int(unique[-1]) - low + 1, dtype=np.int64)
+        table.fill(-1)
+        table[unique.astype(np.int64) - low] = np.arange(len(unique))
+        shifted = values.astype(np.int64) - low
+        inside = (shifted >= 0) & (shifted < len(table))
+        codes[inside] = table[shifted[inside]]
+        return codes
+    positions = np.minimum(unique.searchsorted(values), len(unique) - 1)
+    found = unique[positions] == values
+    codes[found] = positions[found]
+    return codes
+
+def resize(array, rows_number, count):
+    """ Return a new array with 'rows_number' rows; the first 'count' rows
+    are copied from the given array.
+    """
+    result = np.zeros((rows_number,), dtype=array.dtype)
+    result[:count] = array[:count]
+    return result
+
+def resize_file(array, rows_number):
+    """ Change the number of rows of a memory-mapped .npy file and return
+    a new map of the file; rows are not copied unless the header of the file
+    changes its size.
+    """
+    array.flush()
+    filename, dtype = array.filename, array.dtype
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        header, { "descr": np.lib.format.dtype_to_descr(dtype),
+                  "fortran_order": False,
+                  "shape": (rows_number,) })
+    header = header.getvalue()
+
+    if len(header) != array.offset:
+        count = min(len(array), rows_number)
+        new_array = np.lib.format.open_memmap(
+            filename + ".new", "w+", dtype, (rows_number,))
+        new_array[:count] = array[:count]
+        new_array.flush()
+        del new_array
+        os.rename(filename + ".new", filename)
+        return np.load(filename, mmap_mode="r+")
+
+    with open(filename, "r+b") as f:
+        f.write(header)
+        f.truncate(len(header) + rows_number * dtype.itemsize)
+    return np.memmap(filename, dtype, "r+", len(header), (rows_number,))
+
+def to_column(values, dtype):
+    """ Return a couple (array, valid) for a sequence of values where None
+    is an invalid value; 'valid' is None if all values are valid.
+    """
+    if None not in values:
+        return (np.array(values, dtype=dtype), None)
+    data = np.array(values, dtype=object)
+    valid = np.not_equal(data, None)
+    data[~valid] = 0
+    return (data.astype(dtype), valid)
@@ -0,0 +1,157 @@
+#
+#    Copyright (C) 2026 agent
+#
+#    This file is part of Kaira.
+#
+#    Kaira is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kaira is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Kaira.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Reading and writing of tables in files; the functions do not depend
+on the gui, the dialogs of formats are in datatypes.
+"""
+
+import os
+import io
+import csv
+import struct
+import zipfile
+import tempfile
+import itertools
+import numpy as np
+from table import Table
+
+# the number of rows read or written as one block of columns
+csv_chunk_size = 65536
+
+def read_csv(filename, delimiter, quotechar, has_header, has_types,
+             progress=None):
+    """ Read a table from a csv file; rows are converted into columns by
+    blocks, empty values are invalid values.
+
+    Arguments:
+    progress -- a function called with a finished part of the file (0..1)
+    """
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as csvfile:
+        csvreader = csv.reader(
+            csvfile, delimiter=delimiter, quotechar=quotechar)
+
+        try:
+            types = None
+            if has_types:
+                types = csvreader.next()
+
+            header = None
+            if has_header:
+                header = csvreader.next()
+
+            first_row = csvreader.next()
+        except StopIteration:
+            return Table([("V0", "object")], 0)
+
+        if types is None:
+            types = ["object"] * len(first_row)
+        if header is None:
+            header = ["V {0}".format(i + 1) for i in range(len(first_row))]
+        cols_description = zip(header, types)
+
+        table = Table(cols_description, 100)
+        rows = itertools.chain([first_row], csvreader)
+        while True:
+            chunk = [[None if value == '' else value for value in row]
+                     for row in itertools.islice(rows, csv_chunk_size)]
+            if not chunk:
+                return table
+            table.add_rows(chunk)
+            if progress is not None:
+                progress(float(csvfile.tell()) / size)
+
+def write_csv(table, filename, delimiter, quotechar, has_header, has_types,
+              progress=None):
+    """ Write a table into a csv file by blocks of columns; invalid values
+    are written as empty values.
+
+    Arguments:
+    progress -- a function called with a finished part of the table (0..1)
+    """
+    with open(filename, "w") as csvfile:
+        csvwriter = csv.writer(
+            csvfile, delimiter=delimiter, quotechar=quotechar)
+        if has_types:
+            csvwriter.writerow(table.types)
+        if has_header:
+            csvwriter.writerow(table.header)
+        for start in xrange(0, len(table), csv_chunk_size):
+            end = min(start + csv_chunk_size, len(table))
+            columns = []
+            for name in table.header:
+                values = table.values[name][start:end].tolist()
+                for i in np.flatnonzero(table.mask[name][start:end]):
+                    values[i] = None
+                columns.append(values)
+            csvwriter.writerows(zip(*columns))
+            if progress is not None:
+                progress(float(end) / len(table))
+
+def write_npz(table, filename, compress=False):
+    """ Write a table into a .npz file. It contains 'values.npy' with
+    a structured array of rows (names and types of columns are in its
+    dtype) and 'mask.npy' with masks of invalid values.
+
+    Arguments:
+    compress -- if False, the file can be loaded as a memory map
+    """
+    compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    arrays = (("values.npy", table.values[:len(table)]),
+              ("mask.npy", table.mask[:len(table)]))
+    handle, tmp_filename = tempfile.mkstemp(suffix=".npy")
+    os.close(handle)
+    try:
+        with zipfile.ZipFile(filename, "w", compression, True) as f:
+            for name, array in arrays:
+                np.save(tmp_filename, array)
+                f.write(tmp_filename, name)
+    finally:
+        os.remove(tmp_filename)
+
+def read_npz(filename):
+    """ Read a table from a .npz file written by write_npz. Uncompressed
+    arrays are memory-mapped; changes of the table are not written back.
+    """
+    with zipfile.ZipFile(filename) as f:
+        values, mask = [ map_npy_member(filename, f.getinfo(name))
+                         for name in ("values.npy", "mask.npy") ]
+    if values.dtype.names is None: # a table without columns
+        return Table([], 0)
+    return Table.create_from_arrays(values, mask)
+
+def map_npy_member(filename, info):
+    """ Return an array of a .npy member of a zip file; an uncompressed
+    member is mapped copy-on-write, others are read into memory.
+    """
+    if info.compress_type == zipfile.ZIP_STORED:
+        with open(filename, "rb") as f:
+            f.seek(info.header_offset)
+            name_length, extra_length = struct.unpack("<26xHH", f.read(30))
+            f.seek(name_length + extra_length, os.SEEK_CUR)
+            if np.lib.format.read_magic(f) == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            if not dtype.hasobject:
+                return np.memmap(filename, dtype, "c", f.tell(), shape)
+
+    with zipfile.ZipFile(filename) as f:
+        return np.load(io.BytesIO(f.read(info)), allow_pickle=True)
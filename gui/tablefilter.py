@@ -0,0 +1,249 @@
+#
+#    Copyright (C) 2026 agent
+#
+#    This file is part of Kaira.
+#
+#    Kaira is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, version 3 of the License, or
+#    (at your option) any later version.
+#
+#    Kaira is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with Kaira.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""Filter expressions over rows of tables, e.g.:
+
+    Event == 'T' and (Process in [0, 2] or Duration between 100 and 2000)
+    not `V: (results/ival)` is none and Time > Duration
+
+A column is an identifier or any name in backquotes. A comparison with
+an invalid value is false, and so is its negation (`not`).
+"""
+
+import re
+import operator
+import numpy as np
+
+token_parser = re.compile(r"""\s*(?:
+    (?P<number>-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?) |
+    (?P<string>'[^']*'|"[^"]*") |
+    (?P<column>`[^`]+`) |
+    (?P<operator><=|>=|==|!=|<|>|=) |
+    (?P<punctuation>[()\[\],]) |
+    (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+
+keywords = ("and", "or", "not", "in", "between", "is", "none")
+
+compare_functions = { "==": operator.eq,
+                      "=": operator.eq,
+                      "!=": operator.ne,
+                      "<": operator.lt,
+                      "<=": operator.le,
+                      ">": operator.gt,
+                      ">=": operator.ge }
+
+
+class FilterException(Exception):
+    pass
+
+class RowFilter(object):
+
+    def __init__(self, text, header=None):
+        """ Parse a filter expression.
+
+        Arguments:
+        text -- an expression
+        header -- names of columns that can be used; None allows all names
+        """
+        self.text = text
+        self.columns = set()
+        self.tokens = tokenize(text)
+        self.position = 0
+        self.root = self._parse_or()
+        if self._peek() is not None:
+            self._error("Unexpected '{0}'".format(self._peek()[1]))
+        if header is not None:
+            for column in self.columns:
+                if column not in header:
+                    raise FilterException(
+                        "Unknown column '{0}'".format(column))
+
+    def evaluate(self, table, rows=slice(None)):
+        """ Return a boolean array telling which rows pass the filter.
+
+        Arguments:
+        table -- a filtered table
+        rows -- a slice or an array of indexes of tested rows
+        """
+        if isinstance(rows, slice):
+            count = len(xrange(*rows.indices(len(table))))
+            rows = slice(*rows.indices(len(table)))
+        else:
+            count = len(rows)
+        result, valid = self.root(table, rows)
+        result = np.asarray(result, dtype=bool) & valid
+        if result.ndim == 0: # the expression does not use any column
+            result = np.repeat(result, count)
+        return result
+
+    def _parse_or(self):
+        node = self._parse_and()
+        while self._accept("word", "or"):
+            node = logical(np.logical_or, node, self._parse_and())
+        return node
+
+    def _parse_and(self):
+        node = self._parse_not()
+        while self._accept("word", "and"):
+            node = logical(np.logical_and, node, self._parse_not())
+        return node
+
+    def _parse_not(self):
+        if self._accept("word", "not"):
+            return negation(self._parse_not())
+        if self._accept("punctuation", "("):
+            node = self._parse_or()
+            self._expect("punctuation", ")")
+            return node
+        return self._parse_condition()
+
+    def _parse_condition(self):
+        left = self._parse_operand()
+        if self._accept("word", "in"):
+            self._expect("punctuation", "[")
+            values = [ self._parse_literal() ]
+            while self._accept("punctuation", ","):
+                values.append(self._parse_literal())
+            self._expect("punctuation", "]")
+            return membership(left, values)
+        if self._accept("word", "between"):
+            low = self._parse_literal()
+            self._expect("word", "and")
+            high = self._parse_literal()
+            return logical(np.logical_and,
+                           comparison(operator.ge, left, constant(low)),
+                           comparison(operator.le, left, constant(high)))
+        if self._accept("word", "is"):
+            negated = self._accept("word", "not")
+            self._expect("word", "none")
+            return invalidity(left, negated)
+        token = self._next()
+        if token is None or token[0] != "operator":
+            self._error("A comparison expected")
+        return comparison(compare_functions[token[1]],
+                          left, self._parse_operand())
+
+    def _parse_operand(self):
+        token = self._peek()
+        if token is not None and (token[0] == "column" or
+                                  (token[0] == "word" and
+                                   token[1] not in keywords)):
+            self._next()
+            name = token[1].strip("`")
+            self.columns.add(name)
+            return column(name)
+        return constant(self._parse_literal())
+
+    def _parse_literal(self):
+        token = self._next()
+        if token is not None and token[0] == "number":
+            if re.match(r"-?\d+$", token[1]):
+                return int(token[1])
+            return float(token[1])
+        if token is not None and token[0] == "string":
+            return token[1][1:-1]
+        self._error("A value expected")
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+
+    def _next(self):
+        token = self._peek()
+        self.position += 1
+        return token
+
+    def _accept(self, kind, value):
+        if self._peek() == (kind, value):
+            self.position += 1
+            return True
+        return False
+
+    def _expect(self, kind, value):
+        if not self._accept(kind, value):
+            self._error("'{0}' expected".format(value))
+
+    def _error(self, message):
+        raise FilterException("{0} in filter '{1}'".format(message, self.text))
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = token_parser.match(text, position)
+        if match is None or match.end() == position:
+            raise FilterException(
+                "Invalid character '{0}' in filter '{1}'".format(
+                    text[position:].strip()[:1], text))
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "word":
+            value = value if value.lower() not in keywords else value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+# Nodes of a parsed expression are functions of a table and rows that
+# return couples (values, valid).
+
+def column(name):
+    def evaluate(table, rows):
+        return (table.values[name][rows], ~table.mask[name][rows])
+    return evaluate
+
+def constant(value):
+    return lambda table, rows: (value, True)
+
+def comparison(function, left, right):
+    def evaluate(table, rows):
+        left_values, left_valid = left(table, rows)
+        right_values, right_valid = right(table, rows)
+        return (function(left_values, right_values),
+                np.logical_and(left_valid, right_valid))
+    return evaluate
+
+def membership(operand, values):
+    def evaluate(table, rows):
+        operand_values, valid = operand(table, rows)
+        return (np.in1d(operand_values, values), valid)
+    return evaluate
+
+def invalidity(operand, negated):
+    def evaluate(table, rows):
+        valid = operand(table, rows)[1]
+        return (valid if negated else np.logical_not(valid), True)
+    return evaluate
+
+def logical(function, left, right):
+    def evaluate(table, rows):
+        left_values, left_valid = left(table, rows)
+        right_values, right_valid = right(table, rows)
+        # invalid operands make their comparisons false
+        return (function(np.logical_and(left_values, left_valid),
+                         np.logical_and(right_values, right_valid)), True)
+    return evaluate
+
+def negation(operand):
+    def evaluate(table, rows):
+        values, valid = operand(table, rows)
+        return (np.logical_not(values), valid)
+    return evaluate
@@ -19,10 +19,16 @@
 #
 
 import xml.etree.ElementTree as xml
+import os
 import utils
 import loader
 import struct
+import mmap
+import heapq
+import multiprocessing
 import controlseq
+import numpy as np
+from itertools import izip
 
 from table import Table
 from runinstance import RunInstance
@@ -30,69 +36,143 @@ from exportri import ExportRunInstance, place_counter_name
 
 zero_char = chr(0)
 
+timeline_columns = [("process", "<i4"), ("event", "<i4")]
+
 class TraceLog:
 
-    def __init__(self, filename, export_data=False):
+    index_version = 1
+    # Traces smaller in total are indexed serially even if more workers
+    # are allowed; starting a pool costs more than indexing them
+    parallel_size = 64 << 20
+    index_names = ("pointers", "ends", "types", "times", "ids")
+
+    def __init__(self,
+                 filename,
+                 export_data=False,
+                 workers=1,
+                 use_index=True,
+                 time_range=None,
+                 follow=False,
+                 snapshot=None):
+        """ Load a tracelog.
+
+        Arguments:
+        filename -- a name of the tracelog header (.kth)
+        export_data -- if True, the table with exported data is created
+        workers -- a maximal number of processes used for indexing of traces;
+        small traces are always indexed in this process
+        use_index -- if True, the preprocessed tracelog is stored into an index
+        file (.kti) next to the tracelog and it is reused when the tracelog
+        is opened again
+        time_range -- a pair (start, end) in nanoseconds; if it is set, only
+        events inside the range are loaded into the timeline and the table
+        with exported data, the initial run instance is the state at 'start'
+        follow -- if True, the tracelog is still being written; only events
+        that are already globally ordered are loaded and more events are
+        read by 'update'
+        snapshot -- the state before the window returned by
+        'get_snapshot_before' of another instance of the tracelog; if it is
+        not set, all events before the window are replayed
+        """
         self.filename = filename
         self.export_data = export_data
+        self.time_range = time_range
+        self.follow = follow
+        self.start_time = 0
         self._read_header()
 
         self.traces = [None] * self.process_count
-        for process_id in xrange(self.process_count):
-            self._read_trace(process_id)
-
         self.first_runinstance = RunInstance(self.project, self.process_count)
 
-        self._preprocess()
+        if follow:
+            # The index file would be outdated immediately
+            self._read_traces(workers)
+            self._preprocess()
+        elif time_range is not None:
+            # Only indexes of traces are reused, a window is never stored
+            if not use_index or not self._load_index(traces_only=True):
+                self._read_traces(workers)
+            self._preprocess(time_range, snapshot)
+        elif not use_index or not self._load_index():
+            self._read_traces(workers)
+            self._preprocess()
+            if use_index:
+                self._store_index()
+
+        self.snapshots = Snapshots(self)
+
+    def is_windowed(self):
+        return self.time_range is not None
+
+    def is_following(self):
+        return self.follow
+
+    def update(self):
+        """ Read events appended to traces since the last update and add
+            them to the timeline and to the table with exported data.
+            Events are added only up to a watermark, the time of the last
+            event that every trace has already reached, because later
+            events may still be preceded by events that are not written yet.
+            Return True if any event was added.
+        """
+        for process_id, trace in enumerate(self.traces):
+            filename = self._get_trace_filename(process_id)
+            # Only traces that have grown are mapped again
+            if os.path.getsize(filename) > len(trace.data):
+                with open(filename, "rb") as f:
+                    trace.extend(map_file(f), self.follow)
+            elif not self.follow:
+                trace.extend(trace.data, False)
+        return self._add_events(self._get_ordered_ranges())
+
+    def stop_following(self):
+        """ Add all remaining events, it is expected that traces are
+            complete (the program has finished).
+        """
+        self.follow = False
+        return self.update()
 
     def execute_visible_events(self, ri, from_event=0, to_event=None):
-        if to_event is None:
-            to_event = len(self.timeline)
-        for i in xrange(from_event, to_event):
-            event_pointer = self.timeline[i]
-            trace = self.traces[event_pointer["process"]]
-            trace.pointer = event_pointer["pointer"]
-            trace.process_event(ri)
-        return ri
+        return self._execute_events(self.timeline, ri, from_event, to_event)
 
-    def execute_all_events(self, ri,from_event=0, to_event=None):
-        if to_event is None:
-            to_event = len(self.full_timeline)
-        for i in xrange(from_event, to_event):
-            event_pointer = self.full_timeline[i]
-            trace = self.traces[event_pointer["process"]]
-            trace.pointer = event_pointer["pointer"]
-            trace.process_event(ri)
-        return ri
+    def execute_all_events(self, ri, from_event=0, to_event=None, profile="full"):
+        """ Execute events of the full timeline on the run instance; see
+            Trace.process_event for decode profiles.
+        """
+        return self._execute_events(
+            self.full_timeline, ri, from_event, to_event, profile)
 
     def get_event_runinstance(self, index):
-        return self.execute_visible_events(
-            self.first_runinstance.copy(), 0, index)
+        return self.snapshots.get_runinstance(index)
+
+    def set_snapshot_policy(self, interval, max_snapshots):
+        """ Set how often run instances are stored for seeking in the
+        replay. A snapshot is taken every 'interval' events; when there are
+        more than 'max_snapshots' snapshots, every second one is dropped and
+        the interval is doubled. Hence more snapshots cost more memory and
+        fewer snapshots cost more replayed events per seek.
+        """
+        self.snapshots = Snapshots(self, interval, max_snapshots)
 
     def get_event_process(self, index):
         if index == 0:
             return "X"
         index -= 1
-        event_pointer = self.timeline[index]
-        return event_pointer["process"]
+        return int(self.timeline.get_column("process")[index])
 
     def get_event_time(self, index):
         if index == 0:
-            return 0
+            return self.start_time
         index -= 1
-        event_pointer = self.timeline[index]
-        trace = self.traces[event_pointer["process"]]
-        trace.pointer = event_pointer["pointer"]
-        return trace.get_next_event_time()
+        process_id, event = self._get_timeline_event(index)
+        return self.traces[process_id].get_event_time(event)
 
     def get_event_name(self, index):
         if index == 0:
             return "Init "
         index -= 1
-        event_pointer = self.timeline[index]
-        trace = self.traces[event_pointer["process"]]
-        trace.pointer = event_pointer["pointer"]
-        return trace.get_next_event_name()
+        process_id, event = self._get_timeline_event(index)
+        return self.traces[process_id].get_event_name(event)
 
     def get_runinstances_count(self):
         return len(self.timeline) + 1
@@ -105,11 +185,10 @@ class TraceLog:
         name = "Tracelog upto {0}".format(time)
         sequence = controlseq.ControlSequence(name)
         ri = self.first_runinstance.copy()
+        processes = self.timeline.get_column("process")
+        events = self.timeline.get_column("event")
         for i in xrange(index):
-            event_pointer = self.timeline[i]
-            trace = self.traces[event_pointer["process"]]
-            trace.pointer = event_pointer["pointer"]
-            trace.process_event(ri)
+            self.traces[processes[i]].process_event(ri, events[i])
             if ri.last_event == "fire":
                 sequence.add_transition_start(ri.last_event_process,
                                               ri.last_event_activity.transition.get_name())
@@ -128,20 +207,209 @@ class TraceLog:
             x = xml.fromstring(f.read())
             self.project = loader.load_project_from_xml(x, "")
 
-    def _read_trace(self, process_id):
-        filename = "{0}-{1}-0.ktt".format(
+    def _get_trace_filename(self, process_id):
+        return "{0}-{1}-0.ktt".format(
             utils.trim_filename_suffix(self.filename),
             process_id)
+
+    def _read_traces(self, workers):
+        if workers > 1 and self.process_count > 1 and \
+           self._get_traces_size() >= self.parallel_size:
+            self._read_traces_parallel(workers)
+        else:
+            for process_id in xrange(self.process_count):
+                self._read_trace(process_id)
+
+    def _read_trace(self, process_id, index=None):
+        filename = self._get_trace_filename(process_id)
         with open(filename, "rb") as f:
-            trace = Trace(f.read(), process_id, self.pointer_size)
+            trace = Trace(map_file(f),
+                          process_id,
+                          self.pointer_size,
+                          index,
+                          self.follow)
             self.traces[process_id] = trace
 
-    def _preprocess(self):
+    def _get_traces_size(self):
+        return sum(os.path.getsize(self._get_trace_filename(process_id))
+                   for process_id in xrange(self.process_count))
+
+    def _read_traces_parallel(self, workers):
+        # Traces are indexed in worker processes, only the arrays of indexes
+        # are sent back; the traces are then mapped again in this process
+        pool = multiprocessing.Pool(min(workers, self.process_count))
+        try:
+            indexes = pool.map(
+                index_trace,
+                [ (self._get_trace_filename(process_id),
+                   process_id,
+                   self.pointer_size,
+                   self.follow)
+                  for process_id in xrange(self.process_count) ])
+        finally:
+            pool.terminate()
+            pool.join()
+
+        for process_id, index in enumerate(indexes):
+            self._read_trace(process_id, index)
+
+    def _get_index_filename(self):
+        return utils.trim_filename_suffix(self.filename) + ".kti"
+
+    def _get_files_stamp(self):
+        """ Return sizes and modification times of all files of the tracelog """
+        filenames = [ self.filename ] + \
+                    [ self._get_trace_filename(process_id)
+                      for process_id in xrange(self.process_count) ]
+        stats = map(os.stat, filenames)
+        return np.array([ (s.st_size, s.st_mtime) for s in stats ], dtype="<f8")
+
+    def _load_index(self, traces_only=False):
+        """ Load the preprocessed tracelog from the index file. Return False
+            when the index file does not exist or it does not correspond to
+            the tracelog. If 'traces_only' is True, only indexes of traces
+            are loaded.
+        """
+        filename = self._get_index_filename()
+        if not os.path.isfile(filename):
+            return False
+        try:
+            with open(filename, "rb") as f:
+                index = np.load(f)
+                # An index with exported data serves also when the data
+                # are not required
+                if index["version"][0] != self.index_version or \
+                   (self.export_data and not traces_only and
+                    not index["export_data"][0]) or \
+                   not np.array_equal(index["stamp"], self._get_files_stamp()):
+                    return False
+
+                for process_id in xrange(self.process_count):
+                    self._read_trace(
+                        process_id,
+                        [ index["trace{0}_{1}".format(process_id, name)]
+                          for name in self.index_names ])
+                for trace, offset in zip(self.traces, index["time_offsets"]):
+                    trace.time_offset = int(offset)
+                if traces_only:
+                    return True
+
+                self.timeline = Table.create_from_data(
+                    np.ma.array(index["timeline"], mask=False))
+                self.full_timeline = Table.create_from_data(
+                    np.ma.array(index["full_timeline"], mask=False))
+                self.missed_receives = int(index["missed_receives"][0])
+                self.data = Table([], 0)
+                if self.export_data:
+                    self.data = Table.create_from_data(
+                        np.ma.array(index["data"], mask=index["mask"]))
+                    if "Time" in self.data.header:
+                        self.data.create_index("Time")
+        except Exception:
+            # A broken index is ignored, the tracelog is processed again
+            self.traces = [None] * self.process_count
+            return False
+        return True
+
+    def _store_index(self):
+        arrays = { "version": np.array([ self.index_version ]),
+                   "export_data": np.array([ self.export_data ]),
+                   "stamp": self._get_files_stamp(),
+                   "time_offsets": np.array([ trace.time_offset
+                                              for trace in self.traces ],
+                                            dtype="<i8"),
+                   "timeline": self.timeline.data.data,
+                   "full_timeline": self.full_timeline.data.data,
+                   "missed_receives": np.array([ self.missed_receives ]) }
+        for process_id, trace in enumerate(self.traces):
+            for name, array in zip(self.index_names, trace.get_index()):
+                arrays["trace{0}_{1}".format(process_id, name)] = array
+        if self.export_data:
+            arrays["data"] = self.data.data.data
+            arrays["mask"] = np.ma.getmaskarray(self.data.data)
+
+        # The index is written into a temporary file and then renamed,
+        # so a half written index is never used
+        filename = self._get_index_filename()
+        tmp_filename = filename + ".tmp"
+        try:
+            with open(tmp_filename, "wb") as f:
+                np.savez(f, **arrays)
+            os.rename(tmp_filename, filename)
+        except EnvironmentError:
+            # The index is only an optimization, e.g. a directory with
+            # the tracelog may be read-only
+            if os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+
+    def _execute_events(self, timeline, ri, from_event, to_event, profile="full"):
+        if to_event is None:
+            to_event = len(timeline)
+        processes = timeline.get_column("process")[from_event:to_event]
+        events = timeline.get_column("event")[from_event:to_event]
+        traces = self.traces
+        for process_id, event in izip(processes.tolist(), events.tolist()):
+            traces[process_id].process_event(ri, event, profile)
+        return ri
+
+    def _get_timeline_event(self, index):
+        return (int(self.timeline.get_column("process")[index]),
+                int(self.timeline.get_column("event")[index]))
+
+    def _merge_traces(self, end_time=None, ranges=None):
+        """ Return a pair of arrays (processes, events) describing the order
+            in which events of all traces are processed. Events are ordered
+            by time; events with the same time are ordered by process id.
+            If 'end_time' is set, the merge stops after the last event
+            with time less or equal to 'end_time'. If 'ranges' is set, only
+            events from ranges (first, last) of traces are merged.
+        """
+        if ranges is None:
+            ranges = [ (0, trace.get_event_count()) for trace in self.traces ]
+        firsts = [ first for first, last in ranges ]
+        times = [ trace.get_times()[first:last]
+                  for trace, (first, last) in zip(self.traces, ranges) ]
+        if all(np.all(t[1:] >= t[:-1]) for t in times):
+            if end_time is not None:
+                # Times are the index for seeking in sorted traces
+                times = [ t[:np.searchsorted(t, np.uint64(end_time), "right")]
+                          for t in times ]
+            # All traces are sorted, a stable sort gives the same result
+            # as merging them
+            processes = np.concatenate(
+                [ np.repeat(np.int32(process_id), len(t))
+                  for process_id, t in enumerate(times) ])
+            events = np.concatenate(
+                [ np.arange(first, first + len(t), dtype="<i4")
+                  for first, t in zip(firsts, times) ])
+            order = np.lexsort((processes, np.concatenate(times)))
+            return processes[order], events[order]
+
+        times = [ t.tolist() for t in times ]
+        heap = [ (t[0], process_id, 0)
+                 for process_id, t in enumerate(times) if t ]
+        heapq.heapify(heap)
+        processes, events = [], []
+        while heap:
+            time, process_id, event = heap[0]
+            if end_time is not None and time > end_time:
+                break
+            processes.append(process_id)
+            events.append(firsts[process_id] + event)
+            event += 1
+            if event < len(times[process_id]):
+                heapq.heapreplace(
+                    heap, (times[process_id][event], process_id, event))
+            else:
+                heapq.heappop(heap)
+        return (np.array(processes, dtype="<i4"),
+                np.array(events, dtype="<i4"))
+
+    def _preprocess(self, time_range=None, snapshot=None):
         # Set time offsets
         starttime = min([ trace.get_init_time() for trace in self.traces ])
         for trace in self.traces:
             trace.time_offset = trace.get_init_time() - starttime
-        trace_times = [ trace.get_next_event_time() for trace in self.traces ]
 
         if self.export_data:
             place_counters = [place_counter_name(p)
@@ -159,38 +427,241 @@ class TraceLog:
             ri = RunInstance(
                 self.project, self.process_count)
 
-        index = 0
-        timeline = Table([("process", "<i4"), ("pointer", "<i4")], 100)
-        full_timeline = Table([("process", "<i4"), ("pointer", "<i4")], 100)
-        while True:
-
-            # Searching for trace with minimal event time
-            minimal_time_index = utils.index_of_minimal_value(trace_times)
-            if minimal_time_index is None:
-                break
-
-            trace = self.traces[minimal_time_index]
-
-            full_timeline.add_row((minimal_time_index, trace.pointer))
-
-            # Timeline update
-            if trace.is_next_event_visible():
-                timeline.add_row(full_timeline[index])
-
-            trace.process_event(ri)
-            trace_times[minimal_time_index] = trace.get_next_event_time()
+        # Without exported data, the run instance serves only for checking
+        # of receives, hence payloads other than sends are not decoded
+        if self.export_data:
+            self.decode_profile = ri.get_decode_profile()
+        else:
+            self.decode_profile = "timing"
+
+        if self.follow:
+            # The run instance is kept, events read later are executed on it
+            self.follow_runinstance = ri
+            self.merged_events = [0] * self.process_count
+            self.timeline = make_timeline([], [])
+            self.full_timeline = make_timeline([], [])
+            self.data = Table([], 0)
+            self.missed_receives = 0
+            self._add_events(self._get_ordered_ranges())
+            return
 
-            index += 1
+        missed_receives = 0
+        if time_range is None:
+            processes, events = self._merge_traces()
+        else:
+            start_time, end_time = time_range
+            # Traces are sought by time, events before the window are not
+            # merged
+            firsts = self._seek_traces(start_time)
+            processes, events = self._merge_traces(
+                end_time,
+                [ (first, trace.get_event_count())
+                  for first, trace in zip(firsts, self.traces) ])
+            self._set_window_start(firsts, ri, snapshot)
+            missed_receives = ri.missed_receives
+            self.start_time = start_time
+
+        full_timeline = make_timeline(processes, events)
+        self._execute_events(full_timeline, ri, 0, None, self.decode_profile)
+
+        # Timeline contains only visible events
+        mask = self._get_visible_mask(processes, events)
+        timeline = make_timeline(processes[mask], events[mask])
 
         self.data = Table([], 0)
         if self.export_data:
             self.data = ri.get_table()
 
-        timeline.trim()
-        full_timeline.trim()
         self.timeline, self.full_timeline = timeline, full_timeline
 
+        self.missed_receives = ri.missed_receives - missed_receives
+
+    def _seek_traces(self, time):
+        """ Return indexes of the first events of traces that are not
+            merged before 'time'.
+        """
+        times = [ trace.get_times() for trace in self.traces ]
+        if all(np.all(t[1:] >= t[:-1]) for t in times):
+            return [ int(np.searchsorted(t, np.uint64(time))) for t in times ]
+        if time == 0:
+            return [ 0 ] * self.process_count
+        processes, events = self._merge_traces(time - 1)
+        return np.bincount(processes, minlength=self.process_count).tolist()
+
+    def _set_window_start(self, firsts, ri, snapshot):
+        """ Set the first run instance and the state of 'ri' to the state
+            before the window; 'firsts' are indexes of the first events of
+            traces inside the window.
+        """
+        if snapshot is None:
+            state = RunInstance(self.project, self.process_count)
+            processes, events = self._merge_traces(
+                ranges=[ (0, first) for first in firsts ])
+        else:
+            # Only events behind the nearest snapshot are replayed
+            state, processes, events = snapshot
+        self._execute_events(make_timeline(processes, events), state, 0, None)
+        state.reset_last_event_info()
+        state.clear_removed_and_new_tokens()
+        self.first_runinstance = state
+
+        ri.set_state(state.snapshot())
+        if self.export_data:
+            # Idles are not replayed, an idle is open until a receive
+            ri.idles = [ trace.get_open_idle(first)
+                         for trace, first in zip(self.traces, firsts) ]
+
+    def get_snapshot_before(self, time):
+        """ Return the state before the first visible event at or behind
+            'time' for loading of a window by another instance of
+            the tracelog (see TraceLog). It is a triple (run instance,
+            processes, events) of the nearest snapshot and visible events
+            that lead from it to 'time'; events are not executed here.
+            None is returned when the state is not known, i.e. 'time' is
+            before the start of a window.
+        """
+        if time < self.start_time:
+            return None
+        times = self._get_timeline_times(self.timeline)
+        index = int(np.searchsorted(times, np.uint64(time)))
+        position, ri = self.snapshots.get_nearest(index)
+        return (ri,
+                self.timeline.get_column("process")[position:index],
+                self.timeline.get_column("event")[position:index])
+
+    def _get_timeline_times(self, timeline):
+        times = np.concatenate([ trace.get_times() for trace in self.traces ])
+        return times[self._get_event_offsets()[timeline.get_column("process")]
+                     + timeline.get_column("event")]
+
+    def _get_event_offsets(self):
+        """ Return offsets of traces; a global index of an event is the
+            offset of its trace plus its index in the trace.
+        """
+        return np.cumsum([0] + [ trace.get_event_count()
+                                 for trace in self.traces[:-1] ])
+
+    def _get_visible_mask(self, processes, events):
+        visible = np.concatenate([ trace.get_visible_events()
+                                   for trace in self.traces ])
+        return visible[self._get_event_offsets()[processes] + events]
+
+    def _get_ordered_ranges(self):
+        """ Return ranges (first, last) of events of traces that are not
+            merged yet; when the tracelog is followed, the ranges end at the
+            watermark.
+        """
+        ranges = [ (first, trace.get_event_count())
+                   for first, trace in zip(self.merged_events, self.traces) ]
+        if not self.follow:
+            return ranges
+
+        # A trace may still continue by an event with its last time;
+        # finished traces do not continue
+        times = [ trace.get_last_time() for trace in self.traces
+                  if not trace.is_finished() ]
+        if not times:
+            return ranges
+        watermark = np.uint64(min(times))
+        result = []
+        for trace, (first, last) in zip(self.traces, ranges):
+            later = np.flatnonzero(trace.get_times()[first:last] >= watermark)
+            if len(later):
+                last = first + later[0]
+            result.append((first, last))
+        return result
+
+    def _add_events(self, ranges):
+        processes, events = self._merge_traces(ranges=ranges)
+        self.merged_events = [ last for first, last in ranges ]
+        if len(processes) == 0:
+            return False
+
+        ri = self.follow_runinstance
+        self._execute_events(make_timeline(processes, events),
+                             ri, 0, None, self.decode_profile)
+        mask = self._get_visible_mask(processes, events)
+        self.full_timeline = extend_timeline(
+            self.full_timeline, processes, events)
+        self.timeline = extend_timeline(
+            self.timeline, processes[mask], events[mask])
+        if self.export_data:
+            self.data = ri.get_table()
         self.missed_receives = ri.missed_receives
+        return True
+
+
+class Snapshots:
+
+    """ Periodic snapshots of run instances on the visible timeline.
+    Snapshots are created lazily, when a seek goes behind the last one.
+    """
+
+    def __init__(self, tracelog, interval=1000, max_snapshots=100):
+        self.tracelog = tracelog
+        self.interval = interval
+        self.max_snapshots = max(max_snapshots, 2)
+        self.runinstances = [ tracelog.first_runinstance.snapshot() ]
+
+    def get_nearest(self, index):
+        """ Return a pair (position, run instance) of the last snapshot
+        before 'index' visible events; no snapshots are created.
+        """
+        position = min(index // self.interval, len(self.runinstances) - 1)
+        return (position * self.interval,
+                self.runinstances[position].snapshot())
+
+    def get_runinstance(self, index):
+        """ Return a new run instance after 'index' visible events """
+        position = index // self.interval
+        while position >= len(self.runinstances):
+            self._add_snapshot()
+            position = index // self.interval
+        ri = self.runinstances[position].snapshot()
+        return self.tracelog.execute_visible_events(
+            ri, position * self.interval, index)
+
+    def _add_snapshot(self):
+        start = (len(self.runinstances) - 1) * self.interval
+        ri = self.runinstances[-1].snapshot()
+        self.tracelog.execute_visible_events(
+            ri, start, start + self.interval)
+        self.runinstances.append(ri)
+
+        if len(self.runinstances) > self.max_snapshots:
+            self.runinstances = self.runinstances[::2]
+            self.interval *= 2
+
+
+def map_file(f):
+    """ Return a read-only memory map of the opened file, so the trace
+        is decoded directly from the page cache. When the file cannot be
+        mapped (e.g. it is empty) its content is read into a string.
+    """
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+        return f.read()
+
+def index_trace(args):
+    """ Return the index of a trace; it is used by worker processes """
+    filename, process_id, pointer_size, follow = args
+    with open(filename, "rb") as f:
+        return Trace(map_file(f),
+                     process_id,
+                     pointer_size,
+                     follow=follow).get_index()
+
+def make_timeline(processes, events):
+    data = np.ma.zeros((len(processes),), dtype=timeline_columns)
+    data["process"] = processes
+    data["event"] = events
+    return Table.create_from_data(data)
+
+def extend_timeline(timeline, processes, events):
+    return make_timeline(
+        np.concatenate((timeline.get_column("process"), processes)),
+        np.concatenate((timeline.get_column("event"), events)))
 
 
 class Trace:
@@ -207,7 +678,42 @@ class Trace:
     struct_int = struct.Struct("<i")
     struct_double = struct.Struct("<d")
 
-    def __init__(self, data, process_id, pointer_size):
+    # Sizes of headers of events (type + time [+ id])
+    event_header_sizes = { "T": 1 + struct_transition_fired.size,
+                           "F": 1 + struct_basic.size,
+                           "R": 1 + struct_receive.size,
+                           "S": 1 + struct_spawn.size,
+                           "I": 1 + struct_basic.size,
+                           "Q": 1 + struct_basic.size }
+
+    # Events with an id (transition id, origin id, net id) behind the time
+    events_with_id = ("T", "R", "S")
+
+    # Codes of types of records that begin events, that close events and
+    # that may stand between a transition firing and its quit record
+    event_codes = np.array([ ord(t) for t in "TFRSIQ" ], dtype=np.uint8)
+    closed_events = np.array([ ord(t) for t in "IQ" ], dtype=np.uint8)
+    value_codes = np.array([ ord(t) for t in "rids" ], dtype=np.uint8)
+
+    # Traces are indexed in chunks of 'index_chunk_size' bytes; the search
+    # for records falls back to a sequential walk after
+    # 'index_max_iterations' rounds and ends of strings are looked up in
+    # 'index_string_lookahead' bytes behind the chunk
+    index_chunk_size = 4 << 20
+    index_max_iterations = 64
+    index_string_lookahead = 4096
+
+    event_names = { "T": "Fire ",
+                    "F": "Fin  ",
+                    "M": "Send ",
+                    "N": "MSend",
+                    "R": "Recv ",
+                    "S": "Spawn",
+                    "I": "Idle ",
+                    "H": "Quit ", # "H" for backward compatability
+                    "Q": "Quit " }
+
+    def __init__(self, data, process_id, pointer_size, index=None, follow=False):
         self.data = data
         self.pointer = 0
         self.process_id = process_id
@@ -218,7 +724,25 @@ class Trace:
             self.struct_token = self.struct_token_8
         else:
             Exception("Invalid pointer size")
+        # Sizes of records (type + data) that can be skipped without decoding
+        self.record_sizes = { "t": 1 + self.struct_token.size,
+                              "r": 1 + self.struct_token.size,
+                              "i": 1 + self.struct_int.size,
+                              "d": 1 + self.struct_double.size }
+        self.record_size_table = np.zeros(256, dtype=np.int64)
+        for t, size in self.record_sizes.items() + \
+                       self.event_header_sizes.items():
+            self.record_size_table[ord(t)] = size
+        self.record_size_table[ord("X")] = 1 + self.struct_basic.size
+        # Sizes of strings and sends depend on their content
+        self.record_size_table[ord("s")] = -1
+        self.record_size_table[ord("M")] = -1
         self.info = self._read_header()
+        self.first_event = self.pointer
+        if index is None:
+            self._build_index(follow)
+        else:
+            self.set_index(index)
 
     def get_init_time(self):
         s = self.info.get("inittime")
@@ -227,56 +751,106 @@ class Trace:
         else:
             return 0
 
-    def is_next_event_visible(self):
-        t = self.data[self.pointer]
-        return t != "I" and t != "M" and t != "N"
+    def get_index(self):
+        """ Return arrays describing events of the trace """
+        return (self.pointers, self.ends, self.types, self.times, self.ids)
 
-    def get_next_event_name(self):
-        """ Return name of event as 5-character string """
-        t = self.data[self.pointer]
-        if t == "T":
-            return "Fire "
-        elif t == "F":
-            return "Fin  "
-        elif t == "M":
-            return "Send "
-        elif t == "N":
-            return "MSend"
-        elif t == "R":
-            return "Recv "
-        elif t == "S":
-            return "Spawn"
-        elif t == "I":
-            return "Idle "
-        elif t == "H" or t == "Q": # "H" for backward compatability
-            return "Quit "
+    def set_index(self, index):
+        self.pointers, self.ends, self.types, self.times, self.ids = index
 
-    def process_event(self, runinstance):
-        t = self.data[self.pointer]
-        self.pointer += 1
+    def get_event_count(self):
+        return len(self.pointers)
+
+    def extend(self, data, follow=True):
+        """ Index events appended to the trace; 'data' is the new content
+            of the whole trace.
+        """
+        self.data = data
+        if len(self.ends):
+            p = int(self.ends[-1])
+        else:
+            p = self.first_event
+        index = self._index_events(p, follow)
+        self.set_index(tuple(np.concatenate(arrays)
+                             for arrays in zip(self.get_index(), index)))
+
+    def is_finished(self):
+        """ Return True if the last event of the trace is the quit of
+            the process, i.e. no more events will be written.
+        """
+        return len(self.types) > 0 and self.types[-1] == "Q"
+
+    def get_last_time(self):
+        """ Return the time of the last event, or the start time of the
+            trace if it is empty.
+        """
+        if len(self.times):
+            return self.get_event_time(len(self.times) - 1)
+        return self.time_offset
+
+    def get_times(self):
+        """ Return times of all events (including the time offset) """
+        return self.times + np.uint64(self.time_offset)
+
+    def get_open_idle(self, end):
+        """ Return the time of the last idle before the event 'end' if it is
+            not followed by a receive, otherwise None.
+        """
+        idles = np.flatnonzero(self.types[:end] == "I")
+        if not len(idles) or np.any(self.types[idles[-1]:end] == "R"):
+            return None
+        return self.get_event_time(idles[-1])
+
+    def get_visible_events(self):
+        """ Return a boolean array; True for events visible in the replay """
+        return np.logical_not(np.in1d(self.types, ["I", "M", "N"]))
+
+    def get_event_time(self, index):
+        return int(self.times[index]) + self.time_offset
+
+    def get_event_name(self, index):
+        """ Return name of event as 5-character string """
+        return self.event_names.get(self.types[index])
+
+    def process_event(self, runinstance, index, profile="full"):
+        """ Execute the event on the run instance.
+
+        Arguments:
+        runinstance -- a run instance
+        index -- an index of the event in the trace
+        profile -- which payloads of the event are decoded: "timing" (only
+        times of events and sends), "counters" (moreover added and removed
+        tokens without their values) or "full"; other payloads are skipped.
+        The run instance gets no tokens in the "timing" profile.
+        """
+        t = self.types[index]
+        time = int(self.times[index]) + self.time_offset
+        self.pointer = int(self.pointers[index]) + self.event_header_sizes[t]
+        if profile == "timing":
+            self._process_event_timing(runinstance, index, t, time)
+            return
         runinstance.pre_event()
         if t == "T":
-            self._process_event_transition_fired(runinstance)
+            self._process_event_transition_fired(
+                runinstance, time, int(self.ids[index]), profile)
         elif t == "F":
-            self._process_event_transition_finished(runinstance)
+            self._process_event_transition_finished(runinstance, time, profile)
         elif t == "R":
-            return self._process_event_receive(runinstance)
+            self._process_event_receive(
+                runinstance, time, int(self.ids[index]), profile)
         elif t == "S":
-            return self._process_event_spawn(runinstance)
+            self._process_event_spawn(
+                runinstance, time, int(self.ids[index]), profile)
         elif t == "I":
-            return self._process_event_idle(runinstance)
+            runinstance.event_idle(self.process_id, time)
         elif t == "Q":
             # This is called only when transition that call ctx.quit is not traced
-            self.pointer -= 1 # _process_event_quit expect the pointer at "Q"
-            self._process_event_quit(runinstance)
-        else:
-            raise Exception("Invalid event type '{0}/{1}' (pointer={2}, process={3})"
-                                .format(t, ord(t), hex(self.pointer), self.process_id))
+            runinstance.event_quit(self.process_id, time)
 
     def is_pointer_at_end(self):
         return self.pointer >= len(self.data)
 
-    def process_tokens_add(self, runinstance, send_time=0):
+    def process_tokens_add(self, runinstance, send_time=0, profile="full"):
         place_id = None
         token_pointer = None
         values = []
@@ -288,6 +862,8 @@ class Trace:
                 values = []
                 self.pointer += 1
                 token_pointer, place_id = self._read_struct_token()
+            elif (t == "i" or t == "d" or t == "s") and profile != "full":
+                self._skip_record(t)
             elif t == "i":
                 self.pointer += 1
                 value = self._read_struct_int()
@@ -318,18 +894,63 @@ class Trace:
                 self.pointer += 1
                 token_pointer, place_id = self._read_struct_token()
                 runinstance.remove_token(place_id, token_pointer)
-            elif t == "M":
-                self.pointer += 1
-                self._process_event_send(runinstance)
             else:
+                # Sends behind removed tokens are processed together with
+                # added tokens
                 break
 
-    def get_next_event_time(self):
-        if self.is_pointer_at_end():
-            return None
+    def _process_event_timing(self, runinstance, index, t, time):
+        """ Execute the event without tokens and values; records of the
+            payload are skipped by their sizes up to the end of the event,
+            only sends, quits and ends are processed.
+        """
+        process_id = self.process_id
+        if t == "T":
+            runinstance.transition_fired(
+                process_id, time, int(self.ids[index]), [])
+        elif t == "F":
+            runinstance.transition_finished(process_id, time)
+        elif t == "R":
+            runinstance.event_receive(process_id, time, int(self.ids[index]))
+        elif t == "S":
+            runinstance.event_spawn(process_id, time, int(self.ids[index]))
+        elif t == "I":
+            runinstance.event_idle(process_id, time)
+        elif t == "Q":
+            runinstance.event_quit(process_id, time)
+
+        data = self.data
+        sizes = self.record_sizes
+        end = int(self.ends[index])
+        p = self.pointer
+        while p < end:
+            r = data[p]
+            if r == "M":
+                self.pointer = p + 1
+                self._process_event_send(runinstance)
+                p = self.pointer
+            elif r == "Q":
+                self.pointer = p
+                self._process_event_quit(runinstance)
+                p = self.pointer
+            elif r == "X":
+                self.pointer = p
+                self._process_end(runinstance)
+                p = self.pointer
+            elif r == "s":
+                p = data.find(zero_char, p + 1) + 1
+            else:
+                p += sizes[r]
+        self.pointer = end
+
+    def _skip_record(self, t):
+        """ Move the pointer behind a record of the type 't' (a token or
+            a value) without decoding it.
+        """
+        if t == "s":
+            self.pointer = self.data.find(zero_char, self.pointer + 1) + 1
         else:
-            return self.struct_basic.unpack_from(self.data, self.pointer + 1)[0] + \
-                   self.time_offset
+            self.pointer += self.record_sizes[t]
 
     def _read_header(self):
         info = {}
@@ -344,20 +965,227 @@ class Trace:
             raise Exception("Invalid format or version of KairaThreadTrace")
         return info
 
-    def _read_struct_transition_fired(self):
-        values = self.struct_transition_fired.unpack_from(self.data, self.pointer)
-        self.pointer += self.struct_transition_fired.size
-        return values
-
-    def _read_struct_transition_finished(self):
-        values = self.struct_basic.unpack_from(self.data, self.pointer)
-        self.pointer += self.struct_basic.size
-        return values
-
-    def _read_struct_receive(self):
-        values = self.struct_receive.unpack_from(self.data, self.pointer)
-        self.pointer += self.struct_receive.size
-        return values
+    def _build_index(self, follow=False):
+        self.set_index(self._index_events(self.pointer, follow))
+
+    def _index_events(self, p, follow):
+        """ Index events in the trace from the offset 'p' and return arrays
+            describing them: pointers (offset of the event), ends (offset
+            behind the event), types, times and ids. Payloads of events
+            (tokens, values, sends) are only skipped, they are decoded by
+            process_event. If 'follow' is True, the trace is still being
+            written and the last event is omitted when more records may be
+            appended to it.
+
+            The trace is processed in chunks; records of a chunk are found
+            by _find_records and grouped into events by _find_event_starts.
+        """
+        size = len(self.data)
+        buffer = np.frombuffer(self.data, dtype=np.uint8) if size \
+                 else np.zeros(0, dtype=np.uint8)
+        chunk_size = self.index_chunk_size
+        pointers = []
+        ends = []
+        types = []
+        while p < size:
+            stop = min(p + chunk_size, size)
+            positions, kinds, end = self._find_records(buffer, p, stop)
+            starts = np.flatnonzero(self._find_event_starts(kinds))
+            if stop < size:
+                # The last event of the chunk may continue in the next one
+                if len(starts) < 2:
+                    chunk_size *= 2
+                    continue
+                pointers.append(positions[starts[:-1]])
+                ends.append(positions[starts[1:]])
+                types.append(kinds[starts[:-1]])
+                p = int(ends[-1][-1])
+                continue
+            event_ends = np.append(positions[starts[1:]], end)
+            event_types = kinds[starts]
+            if end > size:
+                # Incomplete event at the end of the trace; the previous
+                # event is followed by it, so it is complete
+                count = len(starts) - 1
+            elif follow and not (event_types[-1] in self.closed_events or
+                                 kinds[-1] == ord("X")):
+                # Records may be appended to the event until its end is written
+                count = len(starts) - 1
+            else:
+                count = len(starts)
+            pointers.append(positions[starts[:count]])
+            ends.append(event_ends[:count])
+            types.append(event_types[:count])
+            break
+
+        if pointers:
+            pointers = np.concatenate(pointers)
+            ends = np.concatenate(ends)
+            types = np.concatenate(types).view("|S1")
+        else:
+            pointers = np.zeros(0, dtype="<i8")
+            ends = np.zeros(0, dtype="<i8")
+            types = np.zeros(0, dtype="|S1")
+
+        times = gather(buffer, pointers + 1, "<u8")
+        ids = np.empty(len(pointers), dtype="<i4")
+        ids.fill(-1)
+        with_id = np.in1d(types, self.events_with_id)
+        ids[with_id] = gather(
+            buffer, pointers[with_id] + 1 + self.struct_basic.size, "<i4")
+        return (pointers, ends, types, times, ids)
+
+    def _find_records(self, buffer, start, stop):
+        """ Find records (event headers, tokens, values, ...) that begin
+            in the interval <start, stop) of the trace; 'start' has to be
+            the beginning of an event. Return their offsets, types (codes
+            of characters) and the offset behind the last record.
+
+            Every byte that may be a type of a record is taken as
+            a candidate and the offset of the following record is computed
+            for all of them at once. Candidates that are not followed by
+            another candidate and candidates that are not reached from
+            another candidate are dropped until only the chain of records
+            starting at 'start' remains.
+        """
+        size = len(buffer)
+        positions = start + np.flatnonzero(
+            (self.record_size_table != 0)[buffer[start:stop]])
+        if not len(positions) or positions[0] != start:
+            return self._walk_records(buffer, start, stop)
+        kinds = buffer[positions]
+        nexts = positions + self.record_size_table[kinds]
+
+        strings = np.flatnonzero(kinds == ord("s"))
+        if len(strings):
+            nexts[strings] = self._find_string_ends(buffer,
+                                                    positions[strings],
+                                                    stop)
+        sends = np.flatnonzero(kinds == ord("M"))
+        if len(sends):
+            send_size = 1 + self.struct_send.size
+            p = positions[sends]
+            complete = p + send_size <= size
+            counts = gather(buffer,
+                            np.where(complete, p + send_size - 4, 0),
+                            "<i4").astype(np.int64)
+            counts[~complete | (counts < 0)] = size
+            nexts[sends] = p + send_size + counts * self.struct_int.size
+
+        count = len(positions)
+        slots = np.zeros(stop - start, dtype=np.uint32)
+        slots[positions - start] = np.arange(count, dtype=np.uint32)
+        inside = nexts < stop
+        targets = np.minimum(slots[np.minimum(nexts, stop - 1) - start],
+                             count - 1).astype(np.int64)
+        linked = inside & (positions[targets] == nexts)
+
+        # Drop candidates that do not lead behind the chunk
+        alive = linked | ~inside
+        for i in xrange(self.index_max_iterations):
+            reaching = alive & (~inside | alive[targets])
+            if (reaching == alive).all():
+                break
+            alive = reaching
+        else:
+            return self._walk_records(buffer, start, stop)
+
+        # Drop candidates that are not reached from another one; 'count' is
+        # the target of candidates that lead behind the chunk
+        targets[~(alive & inside)] = count
+        incoming = np.bincount(targets, minlength=count + 1)
+        incoming[0] += 1
+        removed = np.flatnonzero(alive & (incoming[:count] == 0))
+        for i in xrange(self.index_max_iterations):
+            if not len(removed):
+                break
+            alive[removed] = False
+            successors, counts = np.unique(targets[removed],
+                                           return_counts=True)
+            incoming[successors] -= counts
+            removed = successors[(incoming[successors] == 0) &
+                                 (successors < count)]
+        else:
+            return self._walk_records(buffer, start, stop)
+
+        if not alive[0]:
+            # The chain of records is broken, the data are invalid
+            return self._walk_records(buffer, start, stop)
+        last = np.flatnonzero(alive)[-1]
+        return positions[alive], kinds[alive], int(nexts[last])
+
+    def _find_string_ends(self, buffer, positions, stop):
+        """ Return offsets behind zero-terminated strings at 'positions' """
+        size = len(buffer)
+        limit = min(stop + self.index_string_lookahead, size)
+        zeros = positions[0] + 1 + np.flatnonzero(
+            buffer[positions[0] + 1:limit] == 0)
+        indexes = np.searchsorted(zeros, positions + 1)
+        found = indexes < len(zeros)
+        ends = np.empty(len(positions), dtype=np.int64)
+        ends.fill(size + 1) # Unterminated string
+        ends[found] = zeros[indexes[found]] + 1
+        if limit < size:
+            for i in np.flatnonzero(~found):
+                end = self.data.find(zero_char, int(positions[i]) + 1)
+                if end != -1:
+                    ends[i] = end + 1
+        return ends
+
+    def _walk_records(self, buffer, start, stop):
+        """ Sequential version of _find_records """
+        data = self.data
+        size = len(data)
+        unpack_int = self.struct_int.unpack_from
+        send_size = 1 + self.struct_send.size
+        positions = []
+        p = start
+        while p < stop:
+            t = data[p]
+            record_size = self.record_size_table[ord(t)]
+            if record_size == 0 or (not positions and
+                                    t not in self.event_header_sizes):
+                raise Exception("Invalid event type '{0}/{1}' (pointer={2}, process={3})"
+                                    .format(t, ord(t), hex(p), self.process_id))
+            positions.append(p)
+            if t == "s":
+                p = data.find(zero_char, p + 1)
+                if p == -1:
+                    p = size + 1 # Unterminated string
+                    break
+                p += 1
+            elif t == "M":
+                if p + send_size > size:
+                    p = size + 1
+                    break
+                count = unpack_int(data, p + send_size - 4)[0]
+                p += send_size + count * self.struct_int.size
+            else:
+                p += record_size
+        positions = np.array(positions, dtype=np.int64)
+        return positions, buffer[positions], p
+
+    def _find_event_starts(self, kinds):
+        """ Return a mask of records (given by codes of their types) that
+            begin events; the first record has to begin an event.
+        """
+        if kinds[0] not in self.event_codes:
+            t = chr(kinds[0])
+            raise Exception("Invalid event type '{0}/{1}' (process={2})"
+                                .format(t, ord(t), self.process_id))
+        starts = np.in1d(kinds, self.event_codes)
+        # A quit record is a part of a transition firing (behind values
+        # of the transition) or a finish of a transition
+        quits = np.flatnonzero(kinds[1:] == ord("Q")) + 1
+        if len(quits):
+            indexes = np.arange(len(kinds))
+            indexes[np.in1d(kinds, self.value_codes)] = 0
+            previous = np.maximum.accumulate(indexes)[quits - 1]
+            inner = (kinds[previous] == ord("T")) | \
+                    (kinds[quits - 1] == ord("F"))
+            starts[quits[inner]] = False
+        starts[0] = True
+        return starts
 
     def _read_struct_send(self):
         time, size, edge_id, count = self.struct_send.unpack_from(self.data, self.pointer)
@@ -365,47 +1193,42 @@ class Trace:
         values = [ self._read_struct_int() for i in xrange(count) ]
         return (time, size, edge_id, values)
 
-    def _read_struct_spawn(self):
-        values = self.struct_spawn.unpack_from(self.data, self.pointer)
-        self.pointer += self.struct_spawn.size
-        return values
-
     def _read_struct_quit(self):
         values = self.struct_basic.unpack_from(self.data, self.pointer)
         self.pointer += self.struct_basic.size
         return values
 
     def _process_end(self, runinstance):
-        t = self.data[self.pointer]
-        if t != "X":
+        if self.is_pointer_at_end() or self.data[self.pointer] != "X":
             return
         self.pointer += 1
         values = self.struct_basic.unpack_from(self.data, self.pointer)
         self.pointer += self.struct_basic.size
         runinstance.event_end(self.process_id, values[0] + self.time_offset)
 
-    def _process_event_transition_fired(self, runinstance):
-        time, transition_id = self._read_struct_transition_fired()
+    def _process_event_transition_fired(self,
+                                        runinstance,
+                                        time,
+                                        transition_id,
+                                        profile):
         pointer1 = self.pointer
-        values = self._read_transition_trace_function_data()
+        values = self._read_transition_trace_function_data(profile)
         pointer2 = self.pointer
         self.pointer = pointer1
         runinstance.transition_fired(self.process_id,
-                                     time + self.time_offset,
+                                     time,
                                      transition_id,
                                      values)
         self.process_tokens_remove(runinstance)
         self.pointer = pointer2
         self._process_event_quit(runinstance)
-        self.process_tokens_add(runinstance)
+        self.process_tokens_add(runinstance, profile=profile)
         self._process_end(runinstance)
 
-    def _process_event_transition_finished(self, runinstance):
-        time = self._read_struct_transition_finished()[0]
-        runinstance.transition_finished(self.process_id,
-                                        time + self.time_offset)
+    def _process_event_transition_finished(self, runinstance, time, profile):
+        runinstance.transition_finished(self.process_id, time)
         self._process_event_quit(runinstance)
-        self.process_tokens_add(runinstance)
+        self.process_tokens_add(runinstance, profile=profile)
         self._process_end(runinstance)
 
     def _process_event_send(self, runinstance):
@@ -417,38 +1240,28 @@ class Trace:
                                    size,
                                    edge_id)
 
-    def _process_event_spawn(self, runinstance):
-        time, net_id = self._read_struct_spawn()
-        runinstance.event_spawn(self.process_id,
-                                time + self.time_offset,
-                                net_id)
-        self.process_tokens_add(runinstance)
+    def _process_event_spawn(self, runinstance, time, net_id, profile):
+        runinstance.event_spawn(self.process_id, time, net_id)
+        self.process_tokens_add(runinstance, profile=profile)
 
     def _process_event_quit(self, runinstance):
-        t = self.data[self.pointer]
-        if t != "Q":
+        if self.is_pointer_at_end() or self.data[self.pointer] != "Q":
             return
         self.pointer += 1
         time = self._read_struct_quit()[0]
         runinstance.event_quit(self.process_id,
                                time + self.time_offset)
 
-    def _process_event_receive(self, runinstance):
-        time, origin_id = self._read_struct_receive()
+    def _process_event_receive(self, runinstance, time, origin_id, profile):
         send_time = runinstance.event_receive(
             self.process_id,
-            time + self.time_offset,
+            time,
             origin_id
         ) or 1
 
-        self.process_tokens_add(runinstance, send_time)
+        self.process_tokens_add(runinstance, send_time, profile)
         self._process_end(runinstance)
 
-    def _process_event_idle(self, runinstance):
-        time = self._read_struct_quit()[0]
-        runinstance.event_idle(self.process_id,
-                               time + self.time_offset)
-
     def _read_struct_token(self):
         values = self.struct_token.unpack_from(self.data, self.pointer)
         self.pointer += self.struct_token.size
@@ -472,13 +1285,13 @@ class Trace:
         self.pointer += 1
         return s
 
-    def _read_transition_trace_function_data(self):
+    def _read_transition_trace_function_data(self, profile="full"):
         values = []
         while not self.is_pointer_at_end():
             t = self.data[self.pointer]
-            if t == "r":
-                self.pointer += 1
-                self._read_struct_token()
+            if t == "r" or \
+               ((t == "i" or t == "d" or t == "s") and profile != "full"):
+                self._skip_record(t)
             elif t == "i":
                 self.pointer += 1
                 value = self._read_struct_int()
@@ -494,3 +1307,18 @@ class Trace:
             else:
                 break
         return values
+
+
+def gather(buffer, offsets, dtype):
+    """ Read little-endian integers of the given type from a byte buffer
+        at given offsets. Bytes are read one position at a time, so only
+        arrays of the length of 'offsets' are allocated.
+    """
+    dtype = np.dtype(dtype)
+    unsigned = np.dtype("<u{0}".format(dtype.itemsize))
+    result = np.zeros(len(offsets), dtype=unsigned)
+    for i in xrange(dtype.itemsize):
+        values = buffer[offsets + i].astype(unsigned)
+        values <<= 8 * i
+        result |= values
+    return result.view(dtype)
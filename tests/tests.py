@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from testutils import Project
+from testutils import Project, KAIRA_GUI
 import unittest
+import sys
+import os
+import glob
+import shutil
+import tempfile
+import numpy as np
 
 class BuildTest(unittest.TestCase):
 
@@ -137,6 +143,74 @@ class BuildTest(unittest.TestCase):
         p = Project("tracelog", trace=True)
         p.quick_test(processes=2, extra_args=["-T100K"])
         p.check_tracelog("14\n")
+        # The second run uses the index file created by the first one
+        p.check_tracelog("14\n")
+
+    def test_tracelog_window_and_follow(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        output = p.check_tracelog(None, ["--data"])
+        self.assertEqual(output.split()[0], "14")
+        # A window over the whole run and a followed tracelog give the same
+        # events as a full load
+        p.check_tracelog(output, ["--data", "--window", "0", str(2**63 - 1)])
+        p.check_tracelog(output, ["--data", "--follow"])
+        p.check_tracelog(None, ["--window", "10", "5"], fail=True)
+
+    def test_tracelog_snapshots(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        if KAIRA_GUI not in sys.path:
+            sys.path.append(KAIRA_GUI)
+        import cmdutils # tracelog is imported with faked gui libraries
+
+        def get_state(ri):
+            instances = dict((i, (n.tokens, n.new_tokens, n.removed_tokens,
+                                  n.enabled_transitions))
+                             for i, n in ri.net_instances.items())
+            activities = [ a and (a.__class__, vars(a)) for a in ri.activites ]
+            packets = [ map(vars, packets) for packets in ri.packets ]
+            return (instances, activities, packets, ri.debt_receives,
+                    ri.missed_receives, ri.last_event, ri.last_event_time)
+
+        t = cmdutils.tracelog.TraceLog(
+            os.path.join(p.get_directory(), "trace.kth"), use_index=False)
+        count = t.get_runinstances_count()
+        self.assertEqual(count, 14)
+        # Snapshots are thinned out while seeking forward
+        t.set_snapshot_policy(2, 3)
+        for index in [5, 0, 1, 13, 2, 3, 12, 7, 8]:
+            replayed = t.execute_visible_events(
+                t.first_runinstance.snapshot(), 0, index)
+            self.assertEqual(get_state(t.get_event_runinstance(index)),
+                             get_state(replayed))
+        self.assertEqual(t.snapshots.interval, 8)
+
+    def test_report(self):
+        p = Project("tracelog", trace=True)
+        p.quick_test(processes=2, extra_args=["-T100K"])
+        directory = tempfile.mkdtemp()
+        try:
+            # two tracelogs with the same name in different directories
+            filenames = []
+            for name in ("a", "b"):
+                os.mkdir(os.path.join(directory, name))
+                for filename in glob.glob(
+                        os.path.join(p.get_directory(), "trace*.kt[ht]")):
+                    shutil.copy(filename, os.path.join(directory, name))
+                filenames.append(os.path.join(directory, name, "trace.kth"))
+            output = os.path.join(directory, "output")
+            os.mkdir(output)
+
+            files = p.report(filenames, output,
+                             ["--format", "png", "--format", "svg"]).split()
+            self.assertEqual(len(files), 24)
+            self.assertEqual(sorted(files),
+                             sorted(os.path.join(output, name)
+                                    for name in os.listdir(output)))
+            p.report(filenames[:1] * 2, output, fail=True)
+        finally:
+            shutil.rmtree(directory)
 
     def test_scatter1(self):
         Project("scatter1").quick_test("1941\n", processes=5)
@@ -180,5 +254,392 @@ class LibTest(unittest.TestCase):
         finally:
             p.stop_server()
 
+class TableTest(unittest.TestCase):
+
+    def setUp(self):
+        if KAIRA_GUI not in sys.path:
+            sys.path.append(KAIRA_GUI)
+
+    def test_outer_join_empty(self):
+        from table import Table
+        t1 = Table([("ID", "<i4"), ("Value", "<f8")])
+        t1.add_rows([ (i, i * 0.5) for i in xrange(10) ])
+        t2 = Table([("ID", "<i4"), ("Other", "<f8")])
+
+        t = t1.join(t2, ["ID"], outer=True)
+        self.assertEqual(t.header, ["ID", "Value", "Other"])
+        self.assertEqual(len(t), 10)
+        self.assertEqual(list(t.get_column("ID")), range(10))
+        self.assertTrue(t.data["Other"].mask.all())
+        self.assertEqual(len(t1.join(t2, ["ID"])), 0)
+
+    def _filter_table(self):
+        from table import Table
+        t = Table([("Event", "|S1"), ("Process", "<i4"), ("V: x", "<f8")])
+        t.add_rows([ ("T", 0, 1.5),
+                     ("F", 1, None),
+                     ("T", 2, 3.0),
+                     (None, 3, 0.5),
+                     ("R", None, 2.0) ])
+        return t
+
+    def _filter_rows(self, table, text):
+        from tablefilter import RowFilter
+        return list(np.flatnonzero(RowFilter(text, table.header)
+                                   .evaluate(table)))
+
+    def test_filter_precedence(self):
+        t = self._filter_table()
+        self.assertEqual(self._filter_rows(
+            t, "Event == 'T' or Event == 'F' and Process > 1"), [0, 2])
+        self.assertEqual(self._filter_rows(
+            t, "(Event == 'T' or Event == 'F') and Process > 1"), [2])
+        self.assertEqual(self._filter_rows(
+            t, "not Event == 'T' and Process < 2"), [1])
+        self.assertEqual(self._filter_rows(
+            t, "not (Event == 'T' and Process < 2)"), [1, 2, 3, 4])
+        self.assertEqual(self._filter_rows(
+            t, "Process between 1 and 3 and not Process in [2]"), [1, 3])
+
+    def test_filter_columns(self):
+        from tablefilter import RowFilter
+        t = self._filter_table()
+        self.assertEqual(self._filter_rows(t, "`V: x` > 1"), [0, 2, 4])
+        self.assertEqual(self._filter_rows(t, "`V: x` > Process"), [0, 2])
+        self.assertEqual(RowFilter("`V: x` < 1 or Event == 'T'").columns,
+                         set(["V: x", "Event"]))
+
+    def test_filter_invalid_values(self):
+        t = self._filter_table()
+        self.assertEqual(self._filter_rows(t, "`V: x` is none"), [1])
+        self.assertEqual(self._filter_rows(t, "Event is not none"),
+                         [0, 1, 2, 4])
+        self.assertEqual(self._filter_rows(t, "not Event is none"),
+                         [0, 1, 2, 4])
+        # comparisons with invalid values are false, so are their negations
+        self.assertEqual(self._filter_rows(t, "Process != 1"), [0, 2, 3])
+        self.assertEqual(self._filter_rows(t, "not Process == 1"), [0, 2, 3])
+        self.assertEqual(self._filter_rows(t, "not `V: x` > 1"), [3])
+        self.assertEqual(self._filter_rows(t, "not Event in ['T']"), [1, 4])
+        self.assertEqual(self._filter_rows(
+            t, "`V: x` < 1 or Process == 4"), [3])
+
+    def test_filter_errors(self):
+        from tablefilter import RowFilter, FilterException
+        t = self._filter_table()
+        for text in ("Process >", "Process == 1 and", "(Process == 1",
+                     "Process == 1)", "Process in [1, 2", "Process 1",
+                     "Process == 1 # 2", "Event == 'T", "not",
+                     "Process between 1", "Process is 1", "Unknown == 1"):
+            self.assertRaises(FilterException, RowFilter, text, t.header)
+
+    def _aggregate_table(self):
+        from table import Table
+        t = Table([("Group", "<i4"), ("Value", "<f8"), ("Count", "<i8")])
+        t.add_rows([ (i % 4 if i % 7 else None,
+                      i * 0.25 if i % 3 else None,
+                      (i * 37) % 11)
+                     for i in xrange(50) ])
+        # group 5 has only invalid values
+        t.add_rows([ (5, None, None), (5, None, None) ])
+        return t
+
+    def _aggregate_reference(self, table, column, function):
+        groups = {}
+        for row in table:
+            key, value = row[0], row[table.header.index(column)]
+            if key is not None:
+                values = groups.setdefault(key, [])
+                if value is not None:
+                    values.append(value)
+        return dict((key, function(values)) for key, values in groups.items())
+
+    def test_aggregate(self):
+        t = self._aggregate_table()
+        reference = {
+            "count": len,
+            "sum": sum,
+            "min": lambda values: min(values) if values else None,
+            "max": lambda values: max(values) if values else None,
+            "mean": lambda values: (float(sum(values)) / len(values)
+                                    if values else None) }
+        for column in ("Value", "Count"):
+            for function, f in reference.items():
+                expected = self._aggregate_reference(t, column, f)
+                result = t.aggregate(function, column, "Group")
+                self.assertEqual(sorted(result.keys()), sorted(expected.keys()))
+                for key, value in expected.items():
+                    if value is None:
+                        self.assertIsNone(result[key])
+                    else:
+                        self.assertAlmostEqual(result[key], value)
+                values = t.data[column].compressed().tolist()
+                self.assertAlmostEqual(t.aggregate(function, column),
+                                       f(values))
+            self.assertEqual(t.aggregate(np.add, column, "Group"),
+                             self._aggregate_reference(t, column, sum))
+            self.assertEqual(t.aggregate(len, column, "Group"),
+                             self._aggregate_reference(t, column, len))
+
+    def test_aggregate_quantiles_and_histogram(self):
+        t = self._aggregate_table()
+        quantiles = t.aggregate("quantiles", "Value", "Group", q=[0, 0.3, 1])
+        histograms = t.aggregate("histogram", "Value", "Group",
+                                 bins=4, range=(0, 10))
+        expected = self._aggregate_reference(t, "Value", list)
+        for key, values in expected.items():
+            if not values:
+                self.assertIsNone(quantiles[key])
+            else:
+                for result, q in zip(quantiles[key], [0, 30, 100]):
+                    self.assertAlmostEqual(result, np.percentile(values, q))
+            counts, edges = histograms[key]
+            self.assertEqual(list(edges), [0, 2.5, 5, 7.5, 10])
+            self.assertEqual(list(counts),
+                             list(np.histogram(values, 4, (0, 10))[0]))
+        self.assertAlmostEqual(t.aggregate("quantiles", "Count"),
+                               np.median(t.data["Count"].compressed()))
+
+    def test_aggregate_empty(self):
+        from table import Table
+        import operator
+        t = self._aggregate_table()
+        empty = Table([("Group", "<i4"), ("Value", "<f8")])
+        for table, filters in ((empty, []),
+                               (t, [("Group", operator.gt, 10)])):
+            self.assertEqual(table.aggregate("count", "Value",
+                                             filters=filters), 0)
+            self.assertEqual(table.aggregate("sum", "Value",
+                                             filters=filters), 0)
+            for function in ("min", "max", "mean", "quantiles"):
+                self.assertIsNone(table.aggregate(function, "Value",
+                                                  filters=filters))
+                self.assertEqual(table.aggregate(function, "Value", "Group",
+                                                 filters), {})
+            counts, edges = table.aggregate("histogram", "Value",
+                                            filters=filters, bins=2)
+            self.assertEqual(list(counts), [0, 0])
+
+    def _join_reference(self, t1, t2, key, outer, width=1):
+        i1, i2 = t1.header.index(key), t2.header.index(key)
+        rows, rows2 = [], list(t2)
+        for row1 in list(t1):
+            matches = [ row2[:i2] + row2[i2 + 1:] for row2 in rows2
+                        if row1[i1] is not None and row2[i2] is not None and
+                           row2[i2] // width == row1[i1] // width ]
+            if not matches and outer:
+                matches = [ [None] * (len(t2.header) - 1) ]
+            rows.extend(row1 + row2 for row2 in matches)
+        return rows
+
+    def test_join(self):
+        from table import Table
+        t1 = Table([("ID", "<i4"), ("Value", "<f8")])
+        t1.add_rows([ (3, 0.5), (1, None), (None, 2.0), (2, 1.5), (3, 2.5),
+                      (7, 3.0), (1, 4.0) ])
+        t2 = Table([("Other", "|S2"), ("ID", "<i4"), ("Value", "<i4")])
+        t2.add_rows([ ("a", 1, 10), ("b", 3, None), ("c", None, 30),
+                      ("d", 1, 40), (None, 2, 50), ("f", 9, 60) ])
+
+        for outer in (False, True):
+            t = t1.join(t2, ["ID"], outer=outer)
+            self.assertEqual(t.header, ["ID", "Value", "Other", "Value (2)"])
+            self.assertEqual(t.types, ["<i4", "<f8", "|S2", "<i4"])
+            self.assertEqual(list(t),
+                             self._join_reference(t1, t2, "ID", outer))
+
+        self.assertEqual(list(t1.join(t2, [("ID", 2)], outer=True)),
+                         self._join_reference(t1, t2, "ID", True, 2))
+        self.assertEqual(list(t1.join(t1, ["ID"])),
+                         self._join_reference(t1, t1, "ID", False))
+
+    def test_append_rows(self):
+        from table import Table
+        directory = tempfile.mkdtemp()
+        try:
+            for d in (None, directory):
+                t = Table([("ID", "<i4"), ("Name", "|S4"), ("Value", "<f8")],
+                          2, directory=d)
+                t.add_rows([ (1, "a", None), (None, "b", 0.5) ])
+                t.add_row((3, None, 1.5))
+                t.add_rows([])
+                t.extend([ np.arange(4, 9), np.array(["x"] * 5),
+                           np.linspace(0, 1, 5) ],
+                         [ None, np.array([True, False, True, False, True]),
+                           np.arange(5) % 2 == 0 ])
+                t.add_rows([ (9, "c", 2.5) ])
+                self.assertEqual(len(t), 9)
+                self.assertTrue(len(t.values) >= 9)
+                self.assertEqual(list(t), [ [1, "a", None],
+                                            [None, "b", 0.5],
+                                            [3, None, 1.5],
+                                            [4, "x", 0.0],
+                                            [5, None, None],
+                                            [6, "x", 0.5],
+                                            [7, None, None],
+                                            [8, "x", 1.0],
+                                            [9, "c", 2.5] ])
+                self.assertEqual(t.data["Value"].count(), 6)
+                t.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_append_rows_reserve(self):
+        from table import Table
+        t = Table([("ID", "<i4")], 1)
+        sizes = set()
+        for i in xrange(1000):
+            t.add_row((i,))
+            sizes.add(len(t.values))
+        # the reserve doubles, so the table is resized only a few times
+        self.assertTrue(len(sizes) <= 11)
+        t.extend([ np.arange(1000, 5000) ])
+        self.assertEqual(list(t.get_column("ID")), range(5000))
+        self.assertFalse(t.mask["ID"][:len(t)].any())
+        t.trim()
+        self.assertEqual(len(t.values), 5000)
+
+    def test_index(self):
+        from table import Table
+        import operator
+        times = [ 50, 10, None, 30, 10, 70, 30, None, 20 ]
+        t = Table([("Time", "<u8"), ("ID", "<i4")])
+        t.add_rows([ (time, i) for i, time in enumerate(times) ])
+        t.create_index("Time")
+        rows, values = t.get_index("Time")
+        self.assertEqual(list(values), [10, 10, 20, 30, 30, 50, 70])
+        self.assertEqual(list(rows), [1, 4, 8, 3, 6, 0, 5])
+
+        def check(filters):
+            expected = [ i for i, time in enumerate(times)
+                         if time is not None and
+                            all(f_cmp(time, value)
+                                for name, f_cmp, value in filters) ]
+            self.assertEqual(list(t.select("ID", filters)), expected)
+
+        for f_cmp in (operator.eq, operator.lt, operator.le,
+                      operator.gt, operator.ge, operator.ne):
+            for value in (0, 10, 25, 30, 70, 100):
+                check([("Time", f_cmp, value)])
+        check([("Time", operator.ge, 10), ("Time", operator.lt, 50)])
+        check([("Time", operator.gt, 30), ("Time", operator.le, 20)])
+
+        # appended rows invalidate the index
+        times += [ 25, 5 ]
+        t.add_rows([ (25, 9) ])
+        t.add_row((5, 10))
+        self.assertEqual(list(t.get_index("Time")[1]),
+                         [5, 10, 10, 20, 25, 30, 30, 50, 70])
+        check([("Time", operator.ge, 20), ("Time", operator.lt, 30)])
+        times += [ 15 ]
+        t.extend([ np.array([15]), np.array([11]) ])
+        check([("Time", operator.le, 15)])
+
+    def test_query_chunks(self):
+        from table import Table, Query
+        from tablefilter import RowFilter
+        import operator
+        t = Table([("Time", "<u8"), ("Process", "<i4"), ("Value", "<f8")])
+        t.add_rows([ (i * 3, i % 5, i * 0.5 if i % 7 else None)
+                     for i in xrange(1000) ])
+        rows = list(t)
+        chunk_size = Query.chunk_size
+        try:
+            Query.chunk_size = 64
+            q = t.query().where("Process", operator.eq, 2)
+            self.assertEqual(list(q.select("Time").execute()),
+                             [ r[0] for r in rows if r[1] == 2 ])
+            q = q.matching(RowFilter("Value > 100 or Time < 30"))
+            self.assertEqual(q.select(["Time", "Value"]).execute().tolist(),
+                             [ (r[0], r[2]) for r in rows if r[1] == 2 and
+                               (r[2] > 100 or r[0] < 30) ])
+            self.assertEqual(len(q.limit(5).execute()), 5)
+            q = t.query().matching(RowFilter("Value is none"))
+            self.assertEqual(list(q.select("Time").execute()),
+                             [ r[0] for r in rows if r[2] is None ])
+            # rows of a block are returned as a view
+            data = t.query().where("Time", operator.ge, 900).execute()
+            self.assertEqual(len(data), 700)
+            self.assertTrue(np.may_share_memory(data.data, t.values))
+        finally:
+            Query.chunk_size = chunk_size
+
+    def _io_table(self):
+        from table import Table
+        t = Table([("Time", "<u8"), ("Name", "|S8"), ("Value", "<f8"),
+                   ("ID", "<i4")])
+        t.add_rows([ (i * 10, ["a,b", "x\"y", "z", None][i % 4],
+                      i * 0.25 if i % 3 else None, i - 5 if i % 5 else None)
+                     for i in xrange(20) ])
+        return t
+
+    def test_csv(self):
+        from table import Table
+        import tablefile
+        t = self._io_table()
+        directory = tempfile.mkdtemp()
+        chunk_size = tablefile.csv_chunk_size
+        try:
+            tablefile.csv_chunk_size = 6
+            filename = os.path.join(directory, "table.csv")
+            for delimiter, quotechar in ((",", "\""), ("\t", "'")):
+                parts = []
+                tablefile.write_csv(t, filename, delimiter, quotechar,
+                                    True, True, progress=parts.append)
+                self.assertEqual(parts, [0.3, 0.6, 0.9, 1.0])
+                parts = []
+                t2 = tablefile.read_csv(filename, delimiter, quotechar,
+                                        True, True, progress=parts.append)
+                self.assertEqual(len(parts), 4)
+                self.assertEqual(parts[-1], 1.0)
+                self.assertEqual(t2.header, t.header)
+                self.assertEqual(t2.types, t.types)
+                self.assertEqual(list(t2), list(t))
+
+            tablefile.write_csv(t, filename, ",", "\"", False, False)
+            t2 = tablefile.read_csv(filename, ",", "\"", False, False)
+            self.assertEqual(t2.header, ["V 1", "V 2", "V 3", "V 4"])
+            self.assertEqual(list(t2),
+                             [ [ None if value is None else str(value)
+                                 for value in row ] for row in t ])
+
+            tablefile.write_csv(Table(zip(t.header, t.types)),
+                                filename, ",", "\"", True, True)
+            self.assertEqual(len(tablefile.read_csv(filename, ",", "\"",
+                                                    True, True)), 0)
+        finally:
+            tablefile.csv_chunk_size = chunk_size
+            shutil.rmtree(directory)
+
+    def test_npz(self):
+        from table import Table
+        import tablefile
+        t = self._io_table()
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "table.npz")
+            for compress in (False, True):
+                tablefile.write_npz(t, filename, compress)
+                t2 = tablefile.read_npz(filename)
+                self.assertEqual(t2.header, t.header)
+                self.assertEqual(t2.types, t.types)
+                self.assertEqual(list(t2), list(t))
+                # uncompressed arrays are mapped, not read
+                self.assertEqual(isinstance(t2.values, np.memmap),
+                                 not compress)
+                # changes are not written back into the file
+                t2.values["ID"][:] = 7
+                t2.add_rows([ (1, "new", None, 2) ])
+                self.assertEqual(len(t2), len(t) + 1)
+                self.assertEqual(list(tablefile.read_npz(filename)), list(t))
+
+            for table in (Table(zip(t.header, t.types)), Table([], 0)):
+                tablefile.write_npz(table, filename)
+                t2 = tablefile.read_npz(filename)
+                self.assertEqual(t2.header, table.header)
+                self.assertEqual(len(t2), 0)
+        finally:
+            shutil.rmtree(directory)
+
 if __name__ == '__main__':
     unittest.main()
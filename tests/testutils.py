@@ -193,10 +193,26 @@ class Project:
         self.build()
         self.run(result, **kw)
 
-    def check_tracelog(self, output):
+    def check_tracelog(self, output, extra_args=None, fail=False):
         filename = os.path.join(self.get_directory(), "trace.kth")
         args = [ CMDUTILS, "--tracelog", filename ]
-        RunProgram("python", args).run(output)
+        if extra_args:
+            args += extra_args
+        program = RunProgram("python", args)
+        if fail:
+            program.fail()
+        else:
+            return program.run(output)
+
+    def report(self, filenames, directory, extra_args=None, fail=False):
+        args = [ CMDUTILS, "--report" ] + filenames + [ "--output", directory ]
+        if extra_args:
+            args += extra_args
+        program = RunProgram("python", args)
+        if fail:
+            program.fail()
+        else:
+            return program.run()
 
     def build_main(self):
         self.build("lib")